@@ -0,0 +1,355 @@
+import asyncio
+import json
+import os
+import re
+from threading import Thread
+
+from content_cache import async_cached_chat_completion
+from rate_limits import get_gateway, is_provider_unavailable
+
+# LLM enrichment (transcription cleaning and Persian titles)
+ENRICHMENT_CONFIG = {
+    'model': os.getenv('ENRICHMENT_MODEL', 'gemma2-9b-it'),
+    'max_concurrency': int(os.getenv('ENRICHMENT_MAX_CONCURRENCY', '8')),
+    # One JSON-mode call returning cleaned text and title together
+    'single_call': os.getenv('ENRICHMENT_SINGLE_CALL', '').lower() in ('1', 'true', 'yes'),
+    # Longer transcriptions are cleaned in parallel chunks of about this many tokens
+    'chunk_tokens': int(os.getenv('ENRICHMENT_CHUNK_TOKENS', '700'))
+}
+
+# Sentence ends in Persian and Latin text: . ! ? … and the Arabic-script ؟ ؛ ۔ (or a line break)
+SENTENCE_END = re.compile(r'(?<=[.!?…؟؛۔])\s+|\n+')
+
+def build_title_prompt(content, caption=""):
+    """Prompt asking for a Persian real-estate title based on the post content"""
+    return f"""تو یک متخصص تولید عنوان برای آگهی‌های املاک در دبی هستی که باید عنوان‌های جذاب و منحصر به فرد بسازی.
+
+وظیفه تو:
+1. بر اساس محتوای ارائه شده، یک عنوان جذاب، منحصر به فرد و حرفه‌ای به زبان فارسی بنویس
+2. عنوان باید بین 6 تا 15 کلمه باشد
+3. عنوان باید شامل نوع ملک (آپارتمان، ویلا، دفتر، پنت‌هاوس و...) و منطقه دبی باشد
+4. از کلمات جذاب مثل "لوکس"، "منحصر به فرد"، "ویژه"، "استثنایی"، "برتر"، "فوق‌العاده" استفاده کن
+5. عنوان باید برای بازاریابی املاک و SEO مناسب باشد
+6. عنوان باید منعکس‌کننده محتوای واقعی پست باشد
+7. فقط عنوان را بنویس، هیچ توضیح، علامت نقل قول یا متن اضافی نده
+8. عنوان باید کاملاً منحصر به فرد و مرتبط با محتوا باشد
+{content[:500]}
+
+کپشن اصلی:
+{caption[:200] if caption else "بدون کپشن"}
+
+عنوان فارسی:"""
+
+def build_cleaning_prompt(original_transcription, part=None):
+    """Prompt asking for a website-ready edit of a transcription, or of part (index, total) of it"""
+    part_note = f"\nاین متن بخش {part[0]} از {part[1]} ترنسکریپشن است؛ فقط همین بخش را ویرایش کن و چیزی به آن اضافه نکن.\n" if part else ""
+    return f"""تو یک ویراستار حرفه‌ای و باتجربه محتوا برای وبسایت و وبلاگ هستی. متن زیر ترنسکریپشن یک ویدیو از اینستاگرام است.
+وظیفه تو:
+1. متن را برای انتشار در وبسایت و وبلاگ به‌صورت حرفه‌ای، روان و خوانا ویرایش کن.
+2. محتوای اصلی و پیام کلیدی متن را کاملاً حفظ کن، چه مربوط به املاک باشد و چه موضوع دیگری.
+3. کلمات نامناسب، تکرارهای غیرضروری، عبارات غیرحرفه‌ای یا محاوره‌ای را حذف یا اصلاح کن.
+4. جملات ناتمام یا مبهم را واضح و کامل کن، بدون تغییر در معنای اصلی.
+5. تمام اطلاعات کلیدی مانند جزئیات تماس، قیمت‌ها (در صورت وجود) و سایر اطلاعات مهم را دقیقاً حفظ کن.
+6. سبک نوشتار را به‌گونه‌ای تنظیم کن که برای مخاطبان وبسایت حرفه‌ای و جذاب باشد.
+7. فقط متن ویرایش‌شده را ارائه کن، بدون هیچ توضیح اضافی.
+{part_note}
+متن اصلی:
+{original_transcription}
+
+متن تمیز شده:"""
+
+def build_enrichment_prompt(original_transcription, caption=""):
+    """Prompt asking for the cleaned transcription and a title as one JSON object"""
+    return f"""تو یک ویراستار حرفه‌ای محتوا و متخصص تولید عنوان برای آگهی‌های املاک در دبی هستی. متن زیر ترنسکریپشن یک ویدیو از اینستاگرام است.
+
+وظیفه تو:
+1. متن را برای انتشار در وبسایت و وبلاگ به‌صورت حرفه‌ای، روان و خوانا ویرایش کن.
+2. محتوای اصلی، پیام کلیدی و تمام اطلاعات مهم مانند جزئیات تماس و قیمت‌ها (در صورت وجود) را دقیقاً حفظ کن.
+3. کلمات نامناسب، تکرارهای غیرضروری و عبارات محاوره‌ای را حذف یا اصلاح کن، بدون تغییر در معنای اصلی.
+4. بر اساس متن ویرایش‌شده یک عنوان جذاب، منحصر به فرد و حرفه‌ای فارسی بین 6 تا 15 کلمه بنویس که نوع ملک و منطقه دبی را در بر داشته باشد و برای SEO مناسب باشد.
+5. پاسخ را فقط به صورت یک شیء JSON با این کلیدها برگردان، بدون هیچ متن اضافی:
+{{"cleaned_text": "متن ویرایش‌شده", "title": "عنوان فارسی"}}
+
+متن اصلی:
+{original_transcription}
+
+کپشن اصلی:
+{caption[:200] if caption else "بدون کپشن"}"""
+
+def parse_enrichment_response(content):
+    """(cleaned_text, title) from a JSON-mode response, or None when it is empty or not valid JSON"""
+    if not content:
+        return None
+    try:
+        data = json.loads(content)
+    except ValueError:
+        # Some models still wrap the object in a code fence or a sentence
+        match = re.search(r'\{.*\}', content, re.DOTALL)
+        if not match:
+            return None
+        try:
+            data = json.loads(match.group(0))
+        except ValueError:
+            return None
+
+    if not isinstance(data, dict):
+        return None
+    cleaned_text, title = data.get('cleaned_text'), data.get('title')
+    if not isinstance(cleaned_text, str) or not isinstance(title, str):
+        return None
+    return cleaned_text.strip(), title.strip()
+
+def estimate_text_tokens(text):
+    """Conservative token count for Persian text (about 2.5 characters per token)"""
+    return int(len(text) / 2.5) + 1
+
+def split_into_chunks(text, max_tokens):
+    """Split text on sentence boundaries into chunks of at most max_tokens.
+
+    A sentence longer than the budget (unpunctuated speech) is split between
+    words. A short tail is merged into the previous chunk so no chunk is too
+    small to be cleaned on its own.
+    """
+    pieces = []
+    for sentence in SENTENCE_END.split(text.strip()):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        if estimate_text_tokens(sentence) <= max_tokens:
+            pieces.append(sentence)
+            continue
+        words = []
+        for word in sentence.split():
+            if words and estimate_text_tokens(' '.join(words + [word])) > max_tokens:
+                pieces.append(' '.join(words))
+                words = []
+            words.append(word)
+        if words:
+            pieces.append(' '.join(words))
+
+    chunks = []
+    for piece in pieces:
+        if chunks and estimate_text_tokens(f"{chunks[-1]} {piece}") <= max_tokens:
+            chunks[-1] = f"{chunks[-1]} {piece}"
+        else:
+            chunks.append(piece)
+
+    if len(chunks) > 1 and estimate_text_tokens(chunks[-1]) < max_tokens // 4:
+        chunks[-2] = f"{chunks[-2]} {chunks.pop()}"
+    return chunks
+
+def normalize_title(title):
+    """Strip quotes and prefixes from a generated title; None when it is unusable"""
+    # Clean up the title
+    title = title.replace('"', '').replace("'", '').replace('«', '').replace('»', '').strip()
+
+    # Remove any prefixes like "عنوان:" or "Title:"
+    if ':' in title:
+        title = title.split(':', 1)[-1].strip()
+
+    # Validate title length
+    if len(title.split()) < 4 or len(title.split()) > 20:
+        print("⚠️ AI title seems invalid, using fallback")
+        return None
+
+    # Check if title is meaningful (not just generic)
+    generic_words = ['املاک', 'ویژه', 'شماره', 'پست', 'محتوا']
+    if all(word in title for word in generic_words[:3]):
+        print("⚠️ AI title seems too generic, regenerating...")
+        return None
+
+    return title
+
+def is_valid_cleaning(original_transcription, cleaned_text):
+    """Basic validation - ensure we got meaningful content back"""
+    return 20 <= len(cleaned_text) <= len(original_transcription) * 2
+
+class EnrichmentEngine:
+    """Runs the LLM enrichment calls on an asyncio event loop in a background thread.
+
+    Pipeline threads submit work through the sync methods, which block only
+    the caller; up to max_concurrency calls run on the loop at once, so LLM
+    latency overlaps across posts instead of adding up. Requests go through
+    the response cache and the provider's gateway, which caps the requests
+    actually in flight at the provider's in_flight limit.
+    """
+
+    def __init__(self, client, provider='groq', model=None, max_concurrency=None, single_call=None):
+        self.client = client
+        self.gateway = get_gateway(provider)
+        self.model = model or ENRICHMENT_CONFIG['model']
+        self.single_call = ENRICHMENT_CONFIG['single_call'] if single_call is None else single_call
+        self.chunk_tokens = ENRICHMENT_CONFIG['chunk_tokens']
+        self._semaphore = asyncio.Semaphore(max_concurrency or ENRICHMENT_CONFIG['max_concurrency'])
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = Thread(target=self._loop.run_forever, name="enrichment-loop", daemon=True)
+        self._thread.start()
+
+    async def _complete(self, **request):
+        async with self._semaphore:
+            return await async_cached_chat_completion(
+                self.client, gateway=self.gateway, model=self.model, **request
+            )
+
+    def needs_chunking(self, text):
+        return estimate_text_tokens(text) > self.chunk_tokens
+
+    async def _clean_chunk(self, chunk, part):
+        """One cleaned chunk; a chunk the model fails on keeps its original text"""
+        try:
+            cleaned_chunk = (await self._complete(
+                messages=[{"role": "user", "content": build_cleaning_prompt(chunk, part)}],
+                temperature=0.3,
+                # Room for a cleaned chunk somewhat longer than the original
+                max_tokens=min(2000, 2 * estimate_text_tokens(chunk) + 100),
+                top_p=0.9
+            )).strip()
+        except Exception as e:
+            if is_provider_unavailable(e):
+                raise
+            print(f"⚠️ AI cleaning of part {part[0]}/{part[1]} failed: {e}")
+            return chunk, False
+
+        if not is_valid_cleaning(chunk, cleaned_chunk):
+            print(f"⚠️ AI cleaning of part {part[0]}/{part[1]} seems invalid, keeping it as is")
+            return chunk, False
+        return cleaned_chunk, True
+
+    async def _clean_in_chunks(self, original_transcription):
+        chunks = split_into_chunks(original_transcription, self.chunk_tokens)
+        print(f"🤖 Cleaning long transcription with AI in {len(chunks)} parallel parts...")
+
+        results = await asyncio.gather(*(
+            self._clean_chunk(chunk, (index, len(chunks)))
+            for index, chunk in enumerate(chunks, start=1)
+        ))
+
+        cleaned_parts = sum(1 for _, cleaned in results if cleaned)
+        if not cleaned_parts:
+            print("📝 Using original transcription")
+            return original_transcription
+
+        print(f"✅ Transcription cleaned successfully with AI ({cleaned_parts}/{len(chunks)} parts)")
+        return "\n\n".join(text for text, _ in results)
+
+    async def clean_transcription(self, original_transcription):
+        """Cleaned transcription, or the original when the model's answer is unusable
+
+        Transcriptions over the chunk budget are split on sentence boundaries
+        and the parts are cleaned in parallel, so long reels are neither cut
+        off by max_tokens nor rejected as a whole. When the provider is
+        unavailable (see rate_limits.is_provider_unavailable) the error is
+        raised, so the post fails and is retried instead of being saved raw.
+        """
+        if self.needs_chunking(original_transcription):
+            return await self._clean_in_chunks(original_transcription)
+
+        try:
+            print("🤖 Cleaning transcription with AI...")
+            cleaned_text = (await self._complete(
+                messages=[{"role": "user", "content": build_cleaning_prompt(original_transcription)}],
+                temperature=0.3,  # Lower temperature for more consistent cleaning
+                max_tokens=2000,
+                top_p=0.9
+            )).strip()
+
+            if not is_valid_cleaning(original_transcription, cleaned_text):
+                print("⚠️ AI cleaning result seems invalid, using original")
+                return original_transcription
+
+            print("✅ Transcription cleaned successfully with AI")
+            return cleaned_text
+
+        except Exception as e:
+            if is_provider_unavailable(e):
+                raise
+            print(f"⚠️ AI cleaning failed: {e}")
+            print("📝 Using original transcription")
+            return original_transcription
+
+    async def generate_title(self, content, caption=""):
+        """Persian title for the content, or None when the model's answer is unusable
+
+        Raises when the provider is unavailable, like clean_transcription().
+        """
+        try:
+            print("🤖 Generating Persian title with AI...")
+            print(f"📝 Content preview: {content[:100]}...")
+
+            title = normalize_title((await self._complete(
+                messages=[{"role": "user", "content": build_title_prompt(content, caption)}],
+                temperature=0.7,
+                max_tokens=150,
+                top_p=0.9
+            )).strip())
+
+            if title:
+                print(f"✅ Persian title generated: {title}")
+            return title
+
+        except Exception as e:
+            if is_provider_unavailable(e):
+                raise
+            print(f"⚠️ AI title generation failed: {e}")
+            return None
+
+    async def _enrich_single_call(self, original_transcription, caption):
+        try:
+            print("🤖 Cleaning transcription and generating title in one AI call...")
+            response = await self._complete(
+                messages=[{"role": "user", "content": build_enrichment_prompt(original_transcription, caption)}],
+                response_format={"type": "json_object"},
+                temperature=0.3,
+                max_tokens=2150,
+                top_p=0.9
+            )
+        except Exception as e:
+            if is_provider_unavailable(e):
+                raise
+            print(f"⚠️ Single-call enrichment failed: {e}")
+            return None
+
+        parsed = parse_enrichment_response(response)
+        if not parsed:
+            print("⚠️ Single-call enrichment returned invalid JSON")
+            return None
+
+        cleaned_text, title = parsed
+        if not is_valid_cleaning(original_transcription, cleaned_text):
+            print("⚠️ Single-call cleaning result seems invalid")
+            return None
+
+        print("✅ Transcription cleaned successfully with AI")
+        title = normalize_title(title)
+        if title:
+            print(f"✅ Persian title generated: {title}")
+        else:
+            # The cleaned text is fine, only the title needs its own call
+            title = await self.generate_title(cleaned_text, caption)
+        return cleaned_text, title
+
+    async def enrich(self, original_transcription, caption=""):
+        """(cleaned transcription, title) in one JSON-mode call when single_call is on
+
+        Falls back to the separate cleaning and title calls when the combined
+        response cannot be parsed or validated.
+        """
+        # Long transcriptions are cleaned in chunks, which one JSON answer cannot cover
+        if self.single_call and not self.needs_chunking(original_transcription):
+            result = await self._enrich_single_call(original_transcription, caption)
+            if result:
+                return result
+            print("🔁 Falling back to separate cleaning and title calls")
+
+        cleaned_text = await self.clean_transcription(original_transcription)
+        return cleaned_text, await self.generate_title(cleaned_text, caption)
+
+    def run(self, coroutine):
+        """Run a coroutine on the engine's loop and wait for its result"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    def close(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
@@ -0,0 +1,390 @@
+import argparse
+import contextlib
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread, local
+
+from elevenlabs.client import ElevenLabs
+from groq import AsyncGroq
+
+import content_cache
+import instagram_scraper_with_ai as scraper
+import rate_limits
+from ai_enrichment import EnrichmentEngine
+from media_storage import LocalStorage
+from rate_limits import AdaptiveRateLimiter
+from scraper_metrics import RunMetrics, current_run
+
+# Offline benchmark of the per-post pipeline. Instagram, the Instagram CDN,
+# ElevenLabs, Groq and MySQL are replaced by local stand-ins with configurable
+# latency; everything in between (stages, clients, caches, storage, write
+# buffer) is the production code.
+BENCHMARK_CONFIG = {
+    'sizes': [10, 100, 1000],
+    'instagram_latency': 0.01,   # Post metadata/download_post call
+    'media_latency': 0.005,      # CDN thumbnail request
+    'stt_latency': 0.05,         # Speech-to-text request
+    'chat_latency': 0.02,        # Chat completion request
+    'db_latency': 0.002,         # Database round trip (Railway proxy adds several ms)
+    'video_kb': 64,
+    'image_every': 10            # Every Nth post is an image post, filtered before download
+}
+
+BENCHMARK_TRANSCRIPTION = (
+    "سلام دوستان امروز میخوایم یه آپارتمان دو خوابه در دبی مارینا رو ببینیم "
+    "که ویو کامل دریا داره و قیمتش حدود دو میلیون درهمه. "
+) * 4
+BENCHMARK_TITLE = "آپارتمان دو خوابه با ویو دریا در دبی مارینا"
+
+class MockAPIServer:
+    """Local HTTP stand-in for the Instagram CDN, ElevenLabs speech-to-text and Groq chat completions"""
+
+    def __init__(self, media_latency, stt_latency, chat_latency):
+        latencies = {'media': media_latency, 'stt': stt_latency, 'chat': chat_latency}
+        self.requests = {'media': 0, 'stt': 0, 'chat': 0}
+        lock = Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _count(self, kind):
+                with lock:
+                    server.requests[kind] += 1
+                time.sleep(latencies[kind])
+
+            def _reply(self, body, content_type):
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if not self.path.startswith('/media/'):
+                    self.send_error(404)
+                    return
+                self._count('media')
+                self._reply(b'\xff\xd8' + b'\0' * 20 * 1024, 'image/jpeg')
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                if self.path.endswith('/speech-to-text'):
+                    self._count('stt')
+                    response = {'language_code': 'fas', 'language_probability': 0.99,
+                                'text': BENCHMARK_TRANSCRIPTION, 'words': []}
+                elif self.path.endswith('/chat/completions'):
+                    self._count('chat')
+                    prompt = json.loads(body)['messages'][0]['content']
+                    # The cleaning prompt ends with the transcription itself
+                    content = prompt.split("متن اصلی:")[-1].strip() if "متن اصلی:" in prompt else BENCHMARK_TITLE
+                    response = {
+                        'id': 'chatcmpl-benchmark', 'object': 'chat.completion', 'created': int(time.time()),
+                        'model': 'benchmark',
+                        'choices': [{'index': 0, 'finish_reason': 'stop',
+                                     'message': {'role': 'assistant', 'content': content}}],
+                        'usage': {'prompt_tokens': len(prompt) // 3, 'completion_tokens': len(content) // 3,
+                                  'total_tokens': (len(prompt) + len(content)) // 3}
+                    }
+                else:
+                    self.send_error(404)
+                    return
+                self._reply(json.dumps(response, ensure_ascii=False).encode('utf-8'), 'application/json')
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}"
+        Thread(target=self._server.serve_forever, name="mock-api", daemon=True).start()
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+class FakePost:
+    """The parts of instaloader.Post the pipeline reads"""
+
+    def __init__(self, number, date, media_url, is_video=True):
+        self.shortcode = f"BENCH{number:05d}"
+        self.date_utc = date
+        self.typename = 'GraphVideo' if is_video else 'GraphImage'
+        self.is_video = is_video
+        self.video_duration = 45.0 if is_video else None
+        self.url = f"{media_url}/media/{self.shortcode}.jpg"
+        self.caption = "آپارتمان لوکس در دبی مارینا #دبی"
+        self.caption_mentions = []
+        self.caption_hashtags = ['دبی']
+
+def fake_posts(count, media_url, image_every):
+    """count posts, newest first; every image_every-th one is an image post"""
+    newest = datetime(2024, 6, 1, tzinfo=timezone.utc)
+    return [
+        FakePost(number, newest - timedelta(hours=number), media_url,
+                 is_video=not image_every or number % image_every != image_every - 1)
+        for number in range(count)
+    ]
+
+class FakeInstaloader:
+    """Instaloader stand-in whose download_post writes a unique fake video"""
+
+    def __init__(self, latency, video_bytes):
+        self.latency = latency
+        self.video_bytes = video_bytes
+        self.dirname_pattern = None
+        self.filename_pattern = None
+
+    def download_post(self, post, target):
+        time.sleep(self.latency)
+        if not post.is_video:
+            return True
+        # Unique content per post, so the transcription cache never hits
+        with open(os.path.join(self.dirname_pattern, f"{self.filename_pattern}.mp4"), 'wb') as f:
+            f.write(post.shortcode.encode() + b'\0' * self.video_bytes)
+        return True
+
+class FakeInstaloaderProvider:
+    """Per-thread FakeInstaloader instances, like InstaloaderProvider"""
+
+    def __init__(self, latency, video_bytes):
+        self.latency = latency
+        self.video_bytes = video_bytes
+        self._local = local()
+
+    def get(self):
+        ig = getattr(self._local, 'ig', None)
+        if ig is None:
+            ig = self._local.ig = FakeInstaloader(self.latency, self.video_bytes)
+        return ig
+
+    def release(self):
+        self._local.ig = None
+
+    def bind(self, post):
+        return post
+
+class CountingCursor:
+    def __init__(self, db):
+        self.db = db
+        self.lastrowid = None
+
+    def execute(self, query, params=None):
+        self.db.round_trip()
+
+    def executemany(self, query, rows):
+        self.db.round_trip()
+
+    def fetchone(self):
+        return None
+
+    def fetchall(self):
+        return []
+
+    def close(self):
+        pass
+
+class CountingConnection:
+    def __init__(self, db):
+        self.db = db
+
+    def cursor(self, *args, **kwargs):
+        return CountingCursor(self.db)
+
+    def commit(self):
+        self.db.round_trip()
+
+    def rollback(self):
+        self.db.round_trip()
+
+    def is_connected(self):
+        return True
+
+    def close(self):
+        pass
+
+class CountingDatabase:
+    """DatabasePool stand-in: accepts every statement and counts round trips, each costing latency seconds"""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.round_trips = 0
+        self._lock = Lock()
+
+    def round_trip(self):
+        with self._lock:
+            self.round_trips += 1
+        time.sleep(self.latency)
+
+    @contextlib.contextmanager
+    def connection(self):
+        yield CountingConnection(self)
+
+    def run(self, operation):
+        return operation(CountingConnection(self))
+
+    def close(self):
+        pass
+
+def configure_stand_ins(server):
+    """Point the scraper's module-level clients and limiters at the stand-ins"""
+    # Stand-ins do not throttle: limiters only cost their bookkeeping
+    scraper.instagram_rate_limiter = AdaptiveRateLimiter("Instagram", 1e6, 1e6)
+    scraper.media_rate_limiter = AdaptiveRateLimiter("Instagram CDN", 1e6, 1e6)
+    for limits in rate_limits.PROVIDER_LIMITS.values():
+        limits.update(rpm=None, tpm=None)
+    rate_limits._gateways.clear()
+
+    scraper.elevenlabs = ElevenLabs(api_key="benchmark", base_url=server.url)
+    if scraper.enrichment_engine:
+        scraper.enrichment_engine.close()
+    scraper.groq_client = AsyncGroq(api_key="benchmark", base_url=server.url, max_retries=0)
+    scraper.enrichment_engine = EnrichmentEngine(scraper.groq_client, provider='groq')
+
+    # The stand-in videos are not real media, so they are uploaded as they are
+    scraper.AUDIO_EXTRACTION_CONFIG['enabled'] = False
+    # LLM reads are bypassed so every post reaches the chat server
+    content_cache.CACHE_CONFIG['bypass'] = True
+
+def use_fresh_cache(workdir):
+    """Give the scenario an empty content cache of its own"""
+    if content_cache._default_cache:
+        content_cache._default_cache.close()
+    content_cache.CACHE_CONFIG['path'] = os.path.join(workdir, "content_cache.sqlite3")
+    content_cache._default_cache = None
+
+def run_scenario(count, config, server, mode, trace_memory):
+    """Process count fake posts and return the scenario's measurements"""
+    workdir = tempfile.mkdtemp(prefix=f"scraper_bench_{count}_")
+    use_fresh_cache(workdir)
+    requests_before = dict(server.requests)
+
+    db = CountingDatabase(config['db_latency'])
+    storage = LocalStorage(public_root=os.path.join(workdir, "public"), public_url="")
+    provider = FakeInstaloaderProvider(config['instagram_latency'], config['video_kb'] * 1024)
+    download_folder = os.path.join(workdir, "staging")
+    os.makedirs(download_folder)
+    posts = fake_posts(count, server.url, config['image_every'])
+    videos = sum(1 for post in posts if post.is_video)
+
+    metrics = RunMetrics(f"benchmark_{mode}_{count}")
+    token = current_run.set(metrics)
+    if trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+
+    try:
+        if mode == "pipeline":
+            write_buffer = scraper.DatabaseWriteBuffer(db)
+            journal = scraper.CheckpointJournal(os.path.join(download_folder, "checkpoints.jsonl"))
+            journal.open(set())
+            context = scraper.create_pipeline_context(
+                1, db, download_folder, set(), set(), {'full_name': "Benchmark"}, "benchmark", 1,
+                write_buffer, provider, storage, journal
+            )
+            summary = scraper.PostPipeline(context, videos).run(iter(posts))
+            write_buffer.close()
+            journal.close()
+            saved = summary['successful_posts']
+        else:
+            # One post after the other through process_single_post, writing straight to the database
+            saved = 0
+            for number, post in enumerate(posts, start=1):
+                result, status = scraper.process_single_post(
+                    post, 1, db, download_folder, number, set(), set(),
+                    {'full_name': "Benchmark"}, "benchmark", provider, storage
+                )
+                saved += status == "success"
+        elapsed = time.perf_counter() - started
+    finally:
+        current_run.reset(token)
+        python_peak = tracemalloc.get_traced_memory()[1] if trace_memory else None
+        if trace_memory:
+            tracemalloc.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    metrics.finish()
+    stages = metrics.stage_summary()
+    return {
+        'mode': mode,
+        'posts': count,
+        'saved': saved,
+        'seconds': round(elapsed, 3),
+        'posts_per_second': round(count / elapsed, 2) if elapsed else None,
+        'db_round_trips': db.round_trips,
+        'db_round_trips_per_saved_post': round(db.round_trips / saved, 2) if saved else None,
+        'api_requests': {kind: server.requests[kind] - requests_before[kind] for kind in server.requests},
+        # ru_maxrss is in KB on Linux and in bytes on macOS; it only ever grows within a process
+        'rss_high_water_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1),
+        'python_peak_mb': round(python_peak / (1024 * 1024), 1) if python_peak is not None else None,
+        'stages': {stage: {'p50': summary['p50'], 'p95': summary['p95']} for stage, summary in stages.items()},
+        'counters': metrics.report()['counters']
+    }
+
+def print_results(results):
+    print(f"\n📊 BENCHMARK RESULTS")
+    print("=" * 78)
+    print(f"{'mode':<10}{'posts':>7}{'saved':>7}{'seconds':>10}{'posts/s':>10}{'db trips':>10}{'trips/post':>12}{'RSS MB':>9}")
+    for result in results:
+        print(f"{result['mode']:<10}{result['posts']:>7}{result['saved']:>7}{result['seconds']:>10.2f}"
+              f"{result['posts_per_second']:>10.2f}{result['db_round_trips']:>10}"
+              f"{result['db_round_trips_per_saved_post'] or 0:>12.2f}{result['rss_high_water_mb']:>9.1f}")
+        if result['python_peak_mb'] is not None:
+            print(f"{'':<10}Python heap peak: {result['python_peak_mb']:.1f} MB")
+        slowest = sorted(result['stages'].items(), key=lambda item: -item[1]['p95'])[:4]
+        print(f"{'':<10}p50/p95: " + ", ".join(f"{stage} {times['p50']:.3f}/{times['p95']:.3f}s" for stage, times in slowest))
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Offline throughput benchmark of the scraper pipeline")
+    parser.add_argument('--posts', type=int, nargs='+', default=BENCHMARK_CONFIG['sizes'],
+                        help="Scenario sizes in posts (default: 10 100 1000)")
+    parser.add_argument('--mode', choices=['pipeline', 'sequential', 'both'], default='pipeline',
+                        help="PostPipeline, process_single_post one post at a time, or both")
+    for name in ('instagram_latency', 'media_latency', 'stt_latency', 'chat_latency', 'db_latency'):
+        parser.add_argument(f"--{name.replace('_', '-')}", type=float, default=BENCHMARK_CONFIG[name],
+                            help=f"Seconds per request (default: {BENCHMARK_CONFIG[name]})")
+    parser.add_argument('--video-kb', type=int, default=BENCHMARK_CONFIG['video_kb'], help="Size of each fake video")
+    parser.add_argument('--trace-memory', action='store_true', help="Also measure the Python heap peak (slower)")
+    parser.add_argument('--output', help="Write the results as JSON to this file")
+    parser.add_argument('--verbose', action='store_true', help="Show the scraper's own output")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    config = {**BENCHMARK_CONFIG, **{name: getattr(args, name) for name in (
+        'instagram_latency', 'media_latency', 'stt_latency', 'chat_latency', 'db_latency', 'video_kb')}}
+    modes = ['pipeline', 'sequential'] if args.mode == 'both' else [args.mode]
+
+    server = MockAPIServer(config['media_latency'], config['stt_latency'], config['chat_latency'])
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(sys.stdout if args.verbose else devnull):
+        configure_stand_ins(server)
+    print(f"🧪 Stand-ins on {server.url}: STT {config['stt_latency']}s, chat {config['chat_latency']}s, "
+          f"Instagram {config['instagram_latency']}s, DB {config['db_latency']}s per round trip")
+
+    results = []
+    try:
+        for mode in modes:
+            for count in sorted(args.posts):
+                print(f"⏱️  {mode}: {count} posts...")
+                with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(sys.stdout if args.verbose else devnull):
+                    result = run_scenario(count, config, server, mode, args.trace_memory)
+                results.append(result)
+                print(f"✅ {count} posts in {result['seconds']:.2f}s ({result['posts_per_second']:.2f} posts/s)")
+    finally:
+        server.close()
+        if scraper.enrichment_engine:
+            scraper.enrichment_engine.close()
+
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'config': config, 'results': results}, f, ensure_ascii=False, indent=2)
+        print(f"📈 Results written to {args.output}")
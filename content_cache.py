@@ -0,0 +1,217 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from threading import Lock
+
+from rate_limits import estimate_chat_tokens
+from scraper_metrics import add_counter
+
+# Cache configuration (shared by the scraper scripts)
+CACHE_CONFIG = {
+    'path': os.getenv('CONTENT_CACHE_PATH', '.scraper_cache/content_cache.sqlite3'),
+    'max_bytes': int(os.getenv('CONTENT_CACHE_MAX_MB', '256')) * 1024 * 1024,
+    'llm_ttl': float(os.getenv('LLM_CACHE_TTL_SECONDS', str(30 * 24 * 3600))),
+    # Bypass skips cache reads; fresh results are still written back
+    'bypass': os.getenv('LLM_CACHE_BYPASS', '').lower() in ('1', 'true', 'yes')
+}
+
+def content_key(*parts):
+    """Stable SHA-256 key for any JSON-serializable request description"""
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def file_digest(path, chunk_size=1024 * 1024):
+    """SHA-256 of a file, read in chunks so large videos are never fully in memory"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class ContentCache:
+    """Persistent key/value cache in a single SQLite file.
+
+    Values are stored per namespace under a content hash, expire after their
+    TTL and are evicted least-recently-used first once the file grows past
+    max_bytes. Safe to share between threads.
+    """
+
+    def __init__(self, path=None, max_bytes=None):
+        self.path = path or CACHE_CONFIG['path']
+        self.max_bytes = max_bytes or CACHE_CONFIG['max_bytes']
+        self._lock = Lock()
+
+        folder = os.path.dirname(self.path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+        self._db = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                expires_at REAL,
+                PRIMARY KEY (namespace, key)
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_entries_accessed ON entries (accessed_at)")
+        self._db.commit()
+        self._total_bytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def get(self, namespace, key):
+        """Return the cached value, or None when missing or expired"""
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value, expires_at FROM entries WHERE namespace = ? AND key = ?",
+                (namespace, key)
+            ).fetchone()
+            if not row:
+                return None
+
+            value, expires_at = row
+            if expires_at is not None and expires_at < now:
+                self._delete(namespace, key)
+                self._db.commit()
+                return None
+
+            self._db.execute(
+                "UPDATE entries SET accessed_at = ? WHERE namespace = ? AND key = ?",
+                (now, namespace, key)
+            )
+            self._db.commit()
+        return json.loads(value)
+
+    def set(self, namespace, key, value, ttl=None):
+        """Store a JSON-serializable value; ttl in seconds, None keeps it until evicted"""
+        now = time.time()
+        payload = json.dumps(value, ensure_ascii=False)
+        size = len(payload.encode('utf-8'))
+        with self._lock:
+            self._delete(namespace, key)
+            self._db.execute(
+                "INSERT INTO entries (namespace, key, value, size, created_at, accessed_at, expires_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (namespace, key, payload, size, now, now, now + ttl if ttl else None)
+            )
+            self._total_bytes += size
+            if self._total_bytes > self.max_bytes:
+                self._evict(now)
+            self._db.commit()
+
+    def _delete(self, namespace, key):
+        row = self._db.execute(
+            "SELECT size FROM entries WHERE namespace = ? AND key = ?", (namespace, key)
+        ).fetchone()
+        if row:
+            self._db.execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (namespace, key))
+            self._total_bytes -= row[0]
+
+    def _evict(self, now):
+        """Drop expired entries, then least recently used ones until 90% of max_bytes"""
+        self._db.execute("DELETE FROM entries WHERE expires_at IS NOT NULL AND expires_at < ?", (now,))
+        self._total_bytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+        target = self.max_bytes * 0.9
+        rows = self._db.execute("SELECT namespace, key, size FROM entries ORDER BY accessed_at").fetchall()
+        for namespace, key, size in rows:
+            if self._total_bytes <= target:
+                break
+            self._db.execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (namespace, key))
+            self._total_bytes -= size
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+_default_cache = None
+_default_cache_lock = Lock()
+
+def get_default_cache():
+    """Process-wide cache instance, opened on first use"""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = ContentCache()
+        return _default_cache
+
+def chat_cache_key(request):
+    """Cache key of a chat completion request"""
+    return content_key(
+        request.get('model'), request.get('messages'),
+        request.get('temperature'), request.get('max_tokens'),
+        {name: value for name, value in request.items()
+         if name not in ('model', 'messages', 'temperature', 'max_tokens')}
+    )
+
+def _cached_content(cache, bypass, key):
+    if bypass:
+        return None
+    cached = cache.get('llm', key)
+    if cached is None:
+        return None
+    add_counter('llm_cache_hits')
+    return cached['content']
+
+def _count_usage(response):
+    """Add the response's token usage to the current metrics run"""
+    usage = getattr(response, 'usage', None)
+    if usage is not None:
+        add_counter('llm_prompt_tokens', getattr(usage, 'prompt_tokens', 0) or 0)
+        add_counter('llm_completion_tokens', getattr(usage, 'completion_tokens', 0) or 0)
+
+def _store_content(cache, key, request, content, ttl):
+    if content:
+        cache.set('llm', key, {'model': request.get('model'), 'content': content},
+                  ttl=CACHE_CONFIG['llm_ttl'] if ttl is None else ttl)
+
+def cached_chat_completion(client, cache=None, bypass=None, ttl=None, gateway=None, **request):
+    """Run client.chat.completions.create(**request) through the cache and return the message text.
+
+    The key covers the model, messages, temperature, max_tokens and any other
+    request option, so a different prompt or setting never hits a stale entry.
+    Cache misses go through gateway (a rate_limits.ProviderGateway) when given.
+    """
+    cache = cache or get_default_cache()
+    bypass = CACHE_CONFIG['bypass'] if bypass is None else bypass
+    key = chat_cache_key(request)
+
+    content = _cached_content(cache, bypass, key)
+    if content is not None:
+        return content
+
+    def create():
+        return client.chat.completions.create(**request)
+
+    response = gateway.call(create, tokens=estimate_chat_tokens(request)) if gateway else create()
+    _count_usage(response)
+    content = response.choices[0].message.content
+
+    _store_content(cache, key, request, content, ttl)
+    return content
+
+async def async_cached_chat_completion(client, cache=None, bypass=None, ttl=None, gateway=None, **request):
+    """cached_chat_completion for async clients (AsyncGroq, AsyncOpenAI)"""
+    cache = cache or get_default_cache()
+    bypass = CACHE_CONFIG['bypass'] if bypass is None else bypass
+    key = chat_cache_key(request)
+
+    content = _cached_content(cache, bypass, key)
+    if content is not None:
+        return content
+
+    async def create():
+        return await client.chat.completions.create(**request)
+
+    response = await (gateway.acall(create, tokens=estimate_chat_tokens(request)) if gateway else create())
+    _count_usage(response)
+    content = response.choices[0].message.content
+
+    _store_content(cache, key, request, content, ttl)
+    return content
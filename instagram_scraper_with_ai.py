@@ -1,21 +1,41 @@
 import instaloader
 import time
 import browser_cookie3
-from instaloader.exceptions import ConnectionException, ProfileNotExistsException, QueryReturnedBadRequestException
+from instaloader.exceptions import ConnectionException, InvalidArgumentException, ProfileNotExistsException, QueryReturnedBadRequestException, TooManyRequestsException
+from instaloader.nodeiterator import FrozenNodeIterator
 import os
 import shutil
 from dotenv import load_dotenv
-from io import BytesIO
 import requests
+from requests.adapters import HTTPAdapter
 from elevenlabs.client import ElevenLabs
 import mysql.connector
-from mysql.connector import Error
+from mysql.connector import Error, errors, pooling
 from datetime import datetime
+from contextlib import contextmanager
 import concurrent.futures
-from threading import Lock
+from threading import Lock, Condition, Thread, BoundedSemaphore, Event, local
+import queue
 import glob
+import subprocess
 import random
-from groq import Groq
+import argparse
+import atexit
+import contextvars
+import copy
+import math
+import json
+import re
+import sys
+from groq import AsyncGroq
+import content_cache
+from content_cache import content_key, file_digest, get_default_cache
+from ai_enrichment import EnrichmentEngine
+from media_storage import create_media_storage, post_media_key, profile_media_key
+from rate_limits import AdaptiveRateLimiter, call_with_backoff, get_gateway, is_provider_unavailable, iterate_with_backoff
+from scraper_metrics import METRICS_CONFIG, RunMetrics, add_counter, current_run, observe, registry, start_metrics_server, timed
+from scraper_tracing import TRACING_CONFIG, Span, current_span, flush_spans, span
+from text_analysis import count_persian_characters
 
 load_dotenv()
 
@@ -38,8 +58,95 @@ DB_CONFIG = {
     'autocommit': True
 }
 
+# Connection pool shared by all pipeline workers (mysql.connector allows at most 32)
+DB_POOL_CONFIG = {
+    'size': min(int(os.getenv('DB_POOL_SIZE', '5')), 32),
+    'retries': int(os.getenv('DB_RETRIES', '3'))
+}
+
+# Write-behind buffer for posts/filtered_posts: flushed every N rows or N seconds
+DB_WRITE_BUFFER_CONFIG = {
+    'max_rows': int(os.getenv('DB_WRITE_BATCH_SIZE', '25')),
+    'max_delay': float(os.getenv('DB_WRITE_FLUSH_SECONDS', '5'))
+}
+
+# Speech-to-text uploads only a small mono Opus track when ffmpeg is available
+AUDIO_EXTRACTION_CONFIG = {
+    'enabled': os.getenv('TRANSCRIBE_AUDIO_ONLY', '1') != '0',
+    'ffmpeg': os.getenv('FFMPEG_PATH') or shutil.which('ffmpeg'),
+    'bitrate': os.getenv('TRANSCRIBE_AUDIO_BITRATE', '24k'),
+    'sample_rate': os.getenv('TRANSCRIBE_AUDIO_SAMPLE_RATE', '16000')
+}
+
+# Media downloads: streamed in chunks to .part files and resumed with HTTP Range
+MEDIA_DOWNLOAD_CONFIG = {
+    'chunk_size': int(os.getenv('MEDIA_DOWNLOAD_CHUNK_KB', '256')) * 1024,
+    'retries': int(os.getenv('MEDIA_DOWNLOAD_RETRIES', '4')),
+    'timeout': (10, 30),  # (connect, read) seconds
+    'pool_size': int(os.getenv('MEDIA_DOWNLOAD_POOL_SIZE', '16'))
+}
+
+# Media layout: posts are staged locally and handed to the media storage
+# (see media_storage.py) once saved. Keep staging on the same filesystem as
+# public/ so the local backend publishes by rename.
+MEDIA_CONFIG = {
+    'staging_root': os.getenv('MEDIA_STAGING_ROOT', '.media_staging')
+}
+
+# Browser whose Instagram cookies are used when no --browser is given
+COOKIE_CONFIG = {
+    'browser': os.getenv('INSTAGRAM_COOKIE_BROWSER', 'chrome')
+}
+
+# Per-post pipeline configuration (worker threads per stage, queue bound between stages)
+PIPELINE_CONFIG = {
+    'queue_size': int(os.getenv('PIPELINE_QUEUE_SIZE', '4')),
+    'workers': {
+        'download': int(os.getenv('PIPELINE_DOWNLOAD_WORKERS', '2')),
+        'transcribe': int(os.getenv('PIPELINE_TRANSCRIBE_WORKERS', '3')),
+        'clean': int(os.getenv('PIPELINE_CLEAN_WORKERS', '3')),
+        'title': int(os.getenv('PIPELINE_TITLE_WORKERS', '3')),
+        'persist': int(os.getenv('PIPELINE_PERSIST_WORKERS', '1'))
+    }
+}
+
+# Incremental sync: stop paginating at the newest post synced by the last run.
+# Like Instaloader's fast-update, the first few posts never stop the scan since
+# they may be pinned.
+SYNC_CONFIG = {
+    'incremental': os.getenv('INCREMENTAL_SYNC', 'true').lower() not in ('0', 'false', 'no'),
+    'possibly_pinned': int(os.getenv('SYNC_POSSIBLY_PINNED', '3'))
+}
+
+# Pre-download filter on post metadata. Videos shorter than min_video_seconds
+# cannot hold 50+ Persian characters of speech; max_video_seconds 0 means no limit.
+POST_FILTER_CONFIG = {
+    'min_video_seconds': float(os.getenv('MIN_VIDEO_SECONDS', '5')),
+    'max_video_seconds': float(os.getenv('MAX_VIDEO_SECONDS', '0'))
+}
+
+# Instagram request rates shared by every thread and Instaloader instance.
+# Requests start at 'rate' per second and adapt between throttles and 'max_rate'.
+INSTAGRAM_RATE_CONFIG = {
+    'rate': float(os.getenv('INSTAGRAM_REQUESTS_PER_SECOND', '0.5')),
+    'max_rate': float(os.getenv('INSTAGRAM_MAX_REQUESTS_PER_SECOND', '1.0')),
+    'burst': int(os.getenv('INSTAGRAM_BURST', '5')),
+    'cooldown': float(os.getenv('INSTAGRAM_COOLDOWN_SECONDS', '30')),
+    'retries': int(os.getenv('INSTAGRAM_RETRIES', '4')),
+    'media_rate': float(os.getenv('INSTAGRAM_MEDIA_REQUESTS_PER_SECOND', '4')),
+    'media_burst': int(os.getenv('INSTAGRAM_MEDIA_BURST', '8'))
+}
+
+# Responses Instagram uses to tell us to slow down
+INSTAGRAM_THROTTLE_ERRORS = (QueryReturnedBadRequestException, TooManyRequestsException)
+
+# Batch mode: profiles scraped at once and posts in flight across all of them
+BATCH_CONFIG = {
+    'max_profiles': int(os.getenv('BATCH_MAX_PROFILES', '3')),
+    'max_posts_in_flight': int(os.getenv('BATCH_MAX_POSTS_IN_FLIGHT', '8'))
+}
+
 # Global variables for thread safety
-db_lock = Lock()
 file_lock = Lock()
 
 try:
@@ -49,12 +156,33 @@ except Exception as e:
     print(f"❌ Error initializing ElevenLabs client: {str(e)}")
     elevenlabs = None
 
+# API calls (listing, post metadata) and CDN downloads (videos, pictures) are limited separately
+instagram_rate_limiter = AdaptiveRateLimiter(
+    "Instagram", INSTAGRAM_RATE_CONFIG['rate'], INSTAGRAM_RATE_CONFIG['burst'],
+    max_rate=INSTAGRAM_RATE_CONFIG['max_rate'], cooldown=INSTAGRAM_RATE_CONFIG['cooldown']
+)
+media_rate_limiter = AdaptiveRateLimiter(
+    "Instagram CDN", INSTAGRAM_RATE_CONFIG['media_rate'], INSTAGRAM_RATE_CONFIG['media_burst'],
+    cooldown=INSTAGRAM_RATE_CONFIG['cooldown']
+)
+
+# One pooled HTTP session for all media downloads keeps connections to the CDN alive
+media_session = requests.Session()
+media_session.mount("https://", HTTPAdapter(
+    pool_connections=MEDIA_DOWNLOAD_CONFIG['pool_size'],
+    pool_maxsize=MEDIA_DOWNLOAD_CONFIG['pool_size']
+))
+
 try:
-    groq_client = Groq(api_key=GROQ_API_KEY)
+    # Retries and backoff are handled by the provider gateway (rate_limits.py)
+    groq_client = AsyncGroq(api_key=GROQ_API_KEY, max_retries=0)
+    # Cleaning and title calls of all pipeline threads share one event loop
+    enrichment_engine = EnrichmentEngine(groq_client, provider='groq')
     print("✅ Groq AI client initialized successfully")
 except Exception as e:
     print(f"❌ Error initializing Groq client: {str(e)}")
     groq_client = None
+    enrichment_engine = None
 
 def clear_instaloader_sessions():
     """Clear all Instaloader session files"""
@@ -85,126 +213,26 @@ def clear_instaloader_sessions():
 
 def generate_persian_title_with_ai(content, caption="", agent_name=""):
     """Generate Persian title using Groq AI"""
-    if not groq_client or not content:
+    if not enrichment_engine or not content:
         print("⚠️ No Groq client or content available for title generation")
         return None
-    
-    try:
-        print("🤖 Generating Persian title with AI...")
-        print(f"📝 Content preview: {content[:100]}...")
-        
-        # Enhanced prompt for better title generation
-        prompt = f"""تو یک متخصص تولید عنوان برای آگهی‌های املاک در دبی هستی که باید عنوان‌های جذاب و منحصر به فرد بسازی.
-
-وظیفه تو:
-1. بر اساس محتوای ارائه شده، یک عنوان جذاب، منحصر به فرد و حرفه‌ای به زبان فارسی بنویس
-2. عنوان باید بین 6 تا 15 کلمه باشد
-3. عنوان باید شامل نوع ملک (آپارتمان، ویلا، دفتر، پنت‌هاوس و...) و منطقه دبی باشد
-4. از کلمات جذاب مثل "لوکس"، "منحصر به فرد"، "ویژه"، "استثنایی"، "برتر"، "فوق‌العاده" استفاده کن
-5. عنوان باید برای بازاریابی املاک و SEO مناسب باشد
-6. عنوان باید منعکس‌کننده محتوای واقعی پست باشد
-7. فقط عنوان را بنویس، هیچ توضیح، علامت نقل قول یا متن اضافی نده
-8. عنوان باید کاملاً منحصر به فرد و مرتبط با محتوا باشد
-{content[:500]}
-
-کپشن اصلی:
-{caption[:200] if caption else "بدون کپشن"}
-
-عنوان فارسی:"""
-
-        response = groq_client.chat.completions.create(
-            messages=[
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            model="gemma2-9b-it",  # Using a more powerful model
-            temperature=0.7,
-            max_tokens=150,
-            top_p=0.9
-        )
-        
-        title = response.choices[0].message.content.strip()
-        
-        # Clean up the title
-        title = title.replace('"', '').replace("'", '').replace('«', '').replace('»', '').strip()
-        
-        # Remove any prefixes like "عنوان:" or "Title:"
-        if ':' in title:
-            title = title.split(':', 1)[-1].strip()
-        
-        # Validate title length
-        if len(title.split()) < 4 or len(title.split()) > 20:
-            print("⚠️ AI title seems invalid, using fallback")
-            return None
-        
-        # Check if title is meaningful (not just generic)
-        generic_words = ['املاک', 'ویژه', 'شماره', 'پست', 'محتوا']
-        if all(word in title for word in generic_words[:3]):
-            print("⚠️ AI title seems too generic, regenerating...")
-            return None
-        
-        print(f"✅ Persian title generated: {title}")
-        return title
-        
-    except Exception as e:
-        print(f"⚠️ AI title generation failed: {e}")
-        print(f"🔍 Error details: {str(e)}")
-        return None
+
+    return enrichment_engine.run(enrichment_engine.generate_title(content, caption))
 
 def clean_transcription_with_ai(original_transcription):
     """Clean transcription using Groq AI"""
-    if not groq_client or not original_transcription:
-        return original_transcription
-    
-    try:
-        print("🤖 Cleaning transcription with AI...")
-        
-        # Enhanced prompt for better transcription cleaning
-        prompt = f"""تو یک ویراستار حرفه‌ای و باتجربه محتوا برای وبسایت و وبلاگ هستی. متن زیر ترنسکریپشن یک ویدیو از اینستاگرام است.
-وظیفه تو:
-1. متن را برای انتشار در وبسایت و وبلاگ به‌صورت حرفه‌ای، روان و خوانا ویرایش کن.
-2. محتوای اصلی و پیام کلیدی متن را کاملاً حفظ کن، چه مربوط به املاک باشد و چه موضوع دیگری.
-3. کلمات نامناسب، تکرارهای غیرضروری، عبارات غیرحرفه‌ای یا محاوره‌ای را حذف یا اصلاح کن.
-4. جملات ناتمام یا مبهم را واضح و کامل کن، بدون تغییر در معنای اصلی.
-5. تمام اطلاعات کلیدی مانند جزئیات تماس، قیمت‌ها (در صورت وجود) و سایر اطلاعات مهم را دقیقاً حفظ کن.
-6. سبک نوشتار را به‌گونه‌ای تنظیم کن که برای مخاطبان وبسایت حرفه‌ای و جذاب باشد.
-7. فقط متن ویرایش‌شده را ارائه کن، بدون هیچ توضیح اضافی.
-
-متن اصلی:
-{original_transcription}
-
-متن تمیز شده:"""
-
-        response = groq_client.chat.completions.create(
-            messages=[
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            model="gemma2-9b-it",  # Using a good model for Persian text
-            temperature=0.3,  # Lower temperature for more consistent cleaning
-            max_tokens=2000,
-            top_p=0.9
-        )
-        
-        cleaned_text = response.choices[0].message.content.strip()
-        
-        # Basic validation - ensure we got meaningful content back
-        if len(cleaned_text) < 20 or len(cleaned_text) > len(original_transcription) * 2:
-            print("⚠️ AI cleaning result seems invalid, using original")
-            return original_transcription
-        
-        print("✅ Transcription cleaned successfully with AI")
-        return cleaned_text
-        
-    except Exception as e:
-        print(f"⚠️ AI cleaning failed: {e}")
-        print("📝 Using original transcription")
+    if not enrichment_engine or not original_transcription:
         return original_transcription
 
+    return enrichment_engine.run(enrichment_engine.clean_transcription(original_transcription))
+
+def enrich_transcription_with_ai(original_transcription, caption=""):
+    """Clean transcription and generate its title, in one call when ENRICHMENT_SINGLE_CALL is on"""
+    if not enrichment_engine or not original_transcription:
+        return original_transcription, None
+
+    return enrichment_engine.run(enrichment_engine.enrich(original_transcription, caption))
+
 def create_database_connection():
     """Create and return a database connection"""
     try:
@@ -215,6 +243,100 @@ def create_database_connection():
         print(f"❌ Error connecting to MySQL database: {e}")
         return None
 
+class DatabasePool:
+    """Pool of MySQL connections shared by all pipeline workers.
+
+    Checkout blocks while every connection is busy instead of failing, and the
+    pool checks a connection is alive before handing it out. Operations run
+    through run() are retried on a fresh connection when the Railway proxy
+    drops the connection mid-query.
+    """
+
+    def __init__(self, config=None, size=None, retries=None):
+        self.size = size or DB_POOL_CONFIG['size']
+        self.retries = retries or DB_POOL_CONFIG['retries']
+        self._slots = BoundedSemaphore(self.size)
+        self._pool = pooling.MySQLConnectionPool(
+            pool_name=f"scraper_pool_{id(self)}",
+            pool_size=self.size,
+            pool_reset_session=False,
+            **(config or DB_CONFIG)
+        )
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection; it goes back to the pool when the block exits"""
+        with self._slots:
+            connection = self._pool.get_connection()
+            try:
+                yield connection
+            finally:
+                connection.close()
+
+    def run(self, operation):
+        """Run operation(connection), reconnecting and retrying on connection loss"""
+        for attempt in range(1, self.retries + 1):
+            try:
+                with self.connection() as connection:
+                    return operation(connection)
+            except (errors.OperationalError, errors.InterfaceError) as e:
+                if attempt == self.retries:
+                    raise
+                print(f"⚠️ Database connection lost ({e}), reconnecting ({attempt}/{self.retries})...")
+                time.sleep(random.uniform(0.5, 1.5) * attempt)
+
+    def close(self):
+        """Disconnect every pooled connection; the pool is unusable afterwards
+
+        Waits for borrowed connections to come back, then takes each one out
+        of the pool with get_connection() and disconnects it instead of
+        returning it.
+        """
+        for _ in range(self.size):
+            self._slots.acquire()
+        for _ in range(self.size):
+            try:
+                connection = self._pool.get_connection()
+            except errors.PoolError:
+                break  # Pool drained
+            except Error:
+                continue  # A dropped connection that failed to reconnect is already closed
+            try:
+                connection.disconnect()
+            except Error:
+                pass
+
+def create_database_pool():
+    """Create and return a connection pool"""
+    try:
+        return DatabasePool()
+    except Error as e:
+        print(f"❌ Error connecting to MySQL database: {e}")
+        return None
+
+def ensure_unique_post_shortcodes(cursor):
+    """Make (agent_id, instagram_shortcode) unique on an existing posts table
+
+    Tables created from the migrations or railway-setup.md only have a
+    non-unique index (or none), so batched inserts could store a post twice.
+    """
+    cursor.execute("""
+        SELECT INDEX_NAME
+        FROM INFORMATION_SCHEMA.STATISTICS
+        WHERE TABLE_SCHEMA = %s AND TABLE_NAME = 'posts' AND NON_UNIQUE = 0
+        GROUP BY INDEX_NAME
+        HAVING GROUP_CONCAT(COLUMN_NAME ORDER BY SEQ_IN_INDEX) = 'agent_id,instagram_shortcode'
+    """, (DB_CONFIG['database'],))
+    if cursor.fetchall():
+        return
+
+    try:
+        cursor.execute("ALTER TABLE posts ADD UNIQUE INDEX unique_agent_shortcode (agent_id, instagram_shortcode)")
+        print("✅ Added unique index on posts (agent_id, instagram_shortcode)")
+    except errors.IntegrityError as e:
+        # Existing duplicates block the index; batched writes still skip known shortcodes
+        print(f"⚠️ Could not add unique index on posts (agent_id, instagram_shortcode), remove duplicate posts first: {e}")
+
 def ensure_database_structure(connection):
     """Ensure the database has the correct structure - OPTIMIZED"""
     try:
@@ -235,6 +357,8 @@ def ensure_database_structure(connection):
         if 'instagram_shortcode' not in existing_columns:
             cursor.execute("ALTER TABLE posts ADD COLUMN instagram_shortcode VARCHAR(50) AFTER original_url")
             cursor.execute("CREATE UNIQUE INDEX idx_agent_shortcode ON posts (agent_id, instagram_shortcode)")
+        else:
+            ensure_unique_post_shortcodes(cursor)
 
         cursor.execute("""
             SELECT TABLE_NAME FROM INFORMATION_SCHEMA.TABLES
@@ -253,6 +377,17 @@ def ensure_database_structure(connection):
                 )
             """)
 
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS agent_sync_state (
+                agent_id VARCHAR(50) PRIMARY KEY,
+                newest_post_date DATETIME NULL,
+                newest_shortcode VARCHAR(50) NULL,
+                backfill_cursor MEDIUMTEXT NULL,
+                backfill_complete BOOLEAN NOT NULL DEFAULT FALSE,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+            )
+        """)
+
         connection.commit()
         return True
     except Error as e:
@@ -262,145 +397,235 @@ def ensure_database_structure(connection):
         if cursor:
             cursor.close()
 
-def count_persian_characters(text):
-    """Count Persian/Farsi characters in text - OPTIMIZED"""
-    if not text:
-        return 0
-
-    persian_chars = set('آابپتثجچحخدذرزژسشصضطظعغفقکگلمنوهی')
-    return sum(1 for char in text if char in persian_chars)
-
-def get_or_create_agent(connection, username, profile_data):
+def get_or_create_agent(db, username, profile_data):
     """Get existing agent or create new one - OPTIMIZED"""
-    try:
+    def get_or_create(connection):
         cursor = connection.cursor()
+        try:
+            cursor.execute("SELECT id FROM agents WHERE instagram = %s", (username,))
+            existing_agent = cursor.fetchone()
 
-        cursor.execute("SELECT id FROM agents WHERE instagram = %s", (username,))
-        existing_agent = cursor.fetchone()
-
-        if existing_agent:
-            return existing_agent[0]
+            if existing_agent:
+                return existing_agent[0]
 
-        timestamp = int(time.time())
-        agent_id = f"{username.replace('.', '-').replace('_', '-')}-{timestamp}"
+            timestamp = int(time.time())
+            agent_id = f"{username.replace('.', '-').replace('_', '-')}-{timestamp}"
 
-        full_name = profile_data.get('full_name', '').strip() or username.replace('.', ' ').replace('_', ' ').title()
-        biography = profile_data.get('biography', '').strip() or f'مشاور املاک حرفه‌ای در دبی. برای آخرین به‌روزرسانی‌های املاک @{username} را دنبال کنید.'
+            full_name = profile_data.get('full_name', '').strip() or username.replace('.', ' ').replace('_', ' ').title()
+            biography = profile_data.get('biography', '').strip() or f'مشاور املاک حرفه‌ای در دبی. برای آخرین به‌روزرسانی‌های املاک @{username} را دنبال کنید.'
 
-        cursor.execute("""
-            INSERT INTO agents (id, name, profile_image, address, bio, phone, email, instagram, created_at)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, NOW())
-        """, (
-            agent_id, full_name, f"/agents/{agent_id}/profile/profile_picture.jpg",
-            "دبی، امارات متحده عربی", biography, None, None, username
-        ))
+            cursor.execute("""
+                INSERT INTO agents (id, name, profile_image, address, bio, phone, email, instagram, created_at)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, NOW())
+            """, (
+                agent_id, full_name, f"/agents/{agent_id}/profile/profile_picture.jpg",
+                "دبی، امارات متحده عربی", biography, None, None, username
+            ))
 
-        connection.commit()
-        print(f"✅ New agent created: {agent_id}")
-        return agent_id
+            connection.commit()
+            print(f"✅ New agent created: {agent_id}")
+            return agent_id
+        finally:
+            cursor.close()
 
+    try:
+        return db.run(get_or_create)
     except Error as e:
         print(f"❌ Error getting/creating agent: {e}")
-        connection.rollback()
         return None
-    finally:
-        if cursor:
+
+def update_agent_profile_image(db, agent_id, profile_image):
+    """Point the agent's profile image at the URL it was published to"""
+    def update(connection):
+        cursor = connection.cursor()
+        try:
+            cursor.execute("UPDATE agents SET profile_image = %s WHERE id = %s", (profile_image, agent_id))
+            connection.commit()
+        finally:
             cursor.close()
 
-def get_existing_and_filtered_shortcodes(connection, agent_id):
-    """Get both existing and filtered shortcodes in one query - OPTIMIZED"""
     try:
-        cursor = connection.cursor()
+        db.run(update)
+    except Error as e:
+        print(f"⚠️ Error updating profile image: {e}")
 
-        cursor.execute("SELECT instagram_shortcode FROM posts WHERE agent_id = %s AND instagram_shortcode IS NOT NULL", (agent_id,))
-        existing = {row[0] for row in cursor.fetchall()}
+def get_existing_and_filtered_shortcodes(db, agent_id):
+    """Get both existing and filtered shortcodes in one query - OPTIMIZED"""
+    def fetch(connection):
+        cursor = connection.cursor()
+        try:
+            cursor.execute("SELECT instagram_shortcode FROM posts WHERE agent_id = %s AND instagram_shortcode IS NOT NULL", (agent_id,))
+            existing = {row[0] for row in cursor.fetchall()}
 
-        cursor.execute("SELECT instagram_shortcode FROM filtered_posts WHERE agent_id = %s", (agent_id,))
-        filtered = {row[0] for row in cursor.fetchall()}
+            cursor.execute("SELECT instagram_shortcode FROM filtered_posts WHERE agent_id = %s", (agent_id,))
+            filtered = {row[0] for row in cursor.fetchall()}
 
-        return existing, filtered
+            return existing, filtered
+        finally:
+            cursor.close()
 
+    try:
+        return db.run(fetch)
     except Error as e:
         print(f"❌ Error getting shortcodes: {e}")
         return set(), set()
-    finally:
-        if cursor:
-            cursor.close()
 
-def add_to_filtered_posts(connection, agent_id, shortcode, reason):
+def add_to_filtered_posts(db, agent_id, shortcode, reason, write_buffer=None):
     """Add a post to the filtered posts table - OPTIMIZED"""
-    try:
+    # Counted without the numbers some reasons carry (insufficient_persian_chars_12)
+    add_counter('posts_filtered', reason=re.sub(r'_\d+s?$', '', reason))
+
+    if write_buffer:
+        write_buffer.add_filtered_post(agent_id, shortcode, reason)
+        return
+
+    def insert(connection):
         cursor = connection.cursor()
-        cursor.execute("""
-            INSERT IGNORE INTO filtered_posts (agent_id, instagram_shortcode, filter_reason)
-            VALUES (%s, %s, %s)
-        """, (agent_id, shortcode, reason))
-        connection.commit()
+        try:
+            cursor.execute("""
+                INSERT IGNORE INTO filtered_posts (agent_id, instagram_shortcode, filter_reason)
+                VALUES (%s, %s, %s)
+            """, (agent_id, shortcode, reason))
+            connection.commit()
+        finally:
+            cursor.close()
+
+    try:
+        db.run(insert)
     except Error as e:
         print(f"❌ Error adding to filtered posts: {e}")
-    finally:
-        if cursor:
-            cursor.close()
 
-def get_next_post_number(connection, agent_id):
+def get_next_post_number(db, agent_id):
     """Get the next post number - OPTIMIZED"""
-    try:
+    def count(connection):
         cursor = connection.cursor()
-        cursor.execute("SELECT COUNT(*) FROM posts WHERE agent_id = %s", (agent_id,))
-        return cursor.fetchone()[0] + 1
+        try:
+            cursor.execute("SELECT COUNT(*) FROM posts WHERE agent_id = %s", (agent_id,))
+            return cursor.fetchone()[0] + 1
+        finally:
+            cursor.close()
+
+    try:
+        return db.run(count)
     except Error as e:
         return 1
-    finally:
-        if cursor:
+
+def get_sync_state(db, agent_id):
+    """Load the agent's sync cursor; an agent never synced gets an empty state"""
+    def fetch(connection):
+        cursor = connection.cursor()
+        try:
+            cursor.execute("""
+                SELECT newest_post_date, newest_shortcode, backfill_cursor, backfill_complete
+                FROM agent_sync_state WHERE agent_id = %s
+            """, (agent_id,))
+            return cursor.fetchone()
+        finally:
             cursor.close()
 
-def save_post_to_database(connection, agent_id, post_data, post_number):
-    """Save a post to the database with AI-generated title - OPTIMIZED"""
+    state = {'newest_post_date': None, 'newest_shortcode': None, 'backfill_cursor': None, 'backfill_complete': False}
     try:
-        with db_lock:
-            cursor = connection.cursor()
+        row = db.run(fetch)
+    except Error as e:
+        print(f"⚠️ Error loading sync state, doing a full scan: {e}")
+        return state
 
-            timestamp = int(time.time())
-            post_id = f"{agent_id}-post-{post_number:03d}-{timestamp}"
+    if row:
+        state.update(newest_post_date=row[0], newest_shortcode=row[1],
+                     backfill_cursor=row[2], backfill_complete=bool(row[3]))
+    return state
+
+def save_sync_state(db, agent_id, state):
+    """Store the agent's sync cursor"""
+    def upsert(connection):
+        cursor = connection.cursor()
+        try:
+            cursor.execute("""
+                INSERT INTO agent_sync_state (agent_id, newest_post_date, newest_shortcode, backfill_cursor, backfill_complete)
+                VALUES (%s, %s, %s, %s, %s)
+                ON DUPLICATE KEY UPDATE
+                    newest_post_date = VALUES(newest_post_date),
+                    newest_shortcode = VALUES(newest_shortcode),
+                    backfill_cursor = VALUES(backfill_cursor),
+                    backfill_complete = VALUES(backfill_complete)
+            """, (
+                agent_id, state['newest_post_date'], state['newest_shortcode'],
+                state['backfill_cursor'], state['backfill_complete']
+            ))
+            connection.commit()
+        finally:
+            cursor.close()
 
+    try:
+        db.run(upsert)
+    except Error as e:
+        print(f"⚠️ Error saving sync state: {e}")
+
+def save_post_to_database(db, agent_id, post_data, post_number, write_buffer=None):
+    """Save a post to the database with AI-generated title - OPTIMIZED
+
+    With a write_buffer the row is queued for the next batched insert and the
+    post id is returned right away; duplicates and rows the database refuses
+    are then reported by the buffer's take_rejected() after the flush.
+    """
+    timestamp = int(time.time())
+    post_id = f"{agent_id}-post-{post_number:03d}-{timestamp}"
+
+    # Always generate AI title based on content
+    title = post_data.get('title', '')
+    if not title:  # Only generate if no title provided
+        print(f"🤖 Generating AI title for post {post_number}...")
+        ai_title = generate_persian_title_with_ai(
+            post_data.get('content', ''),
+            post_data.get('caption', ''),
+            post_data.get('agent_name', '')
+        )
+
+        if ai_title:
+            title = ai_title
+            print(f"✅ AI title generated: {title}")
+        else:
+            # More descriptive fallback based on content
+            content_preview = post_data.get('content', '')[:100]
+            if 'آپارتمان' in content_preview:
+                title = f"آپارتمان منحصر به فرد در دبی - پست {post_number}"
+            elif 'ویلا' in content_preview:
+                title = f"ویلای لوکس در دبی - پست {post_number}"
+            elif 'دفتر' in content_preview:
+                title = f"دفتر تجاری مدرن در دبی - پست {post_number}"
+            else:
+                title = f"املاک استثنایی در دبی - پست {post_number}"
+            print(f"⚠️ Using enhanced fallback title: {title}")
+
+    # Published media URL; the legacy public/ path when the files are published later
+    thumbnail = post_data.get('thumbnail') or f"/agents/{agent_id}/posts/post_{post_number}_thumbnail.jpg"
+
+    if write_buffer:
+        write_buffer.add_post((
+            post_id, agent_id, title,
+            post_data.get('content', ''), post_data.get('caption', ''),
+            thumbnail,
+            post_data.get('transcription', None), post_data.get('date', datetime.now()),
+            post_data.get('original_url', ''), post_data.get('instagram_shortcode', '')
+        ))
+        print(f"✅ Post queued with title: {title}")
+        return post_id
+
+    def insert(connection):
+        cursor = connection.cursor()
+        try:
             cursor.execute("SELECT id FROM posts WHERE agent_id = %s AND instagram_shortcode = %s",
                           (agent_id, post_data.get('instagram_shortcode', '')))
             if cursor.fetchone():
                 return "duplicate"
 
-            # Always generate AI title based on content
-            title = post_data.get('title', '')
-            if not title:  # Only generate if no title provided
-                print(f"🤖 Generating AI title for post {post_number}...")
-                ai_title = generate_persian_title_with_ai(
-                    post_data.get('content', ''),
-                    post_data.get('caption', ''),
-                    post_data.get('agent_name', '')
-                )
-                
-                if ai_title:
-                    title = ai_title
-                    print(f"✅ AI title generated: {title}")
-                else:
-                    # More descriptive fallback based on content
-                    content_preview = post_data.get('content', '')[:100]
-                    if 'آپارتمان' in content_preview:
-                        title = f"آپارتمان منحصر به فرد در دبی - پست {post_number}"
-                    elif 'ویلا' in content_preview:
-                        title = f"ویلای لوکس در دبی - پست {post_number}"
-                    elif 'دفتر' in content_preview:
-                        title = f"دفتر تجاری مدرن در دبی - پست {post_number}"
-                    else:
-                        title = f"املاک استثنایی در دبی - پست {post_number}"
-                    print(f"⚠️ Using enhanced fallback title: {title}")
-
             cursor.execute("""
                 INSERT INTO posts (id, agent_id, title, content, caption, thumbnail, transcription, date, original_url, instagram_shortcode, created_at)
                 VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, NOW())
             """, (
                 post_id, agent_id, title,
                 post_data.get('content', ''), post_data.get('caption', ''),
-                f"/agents/{agent_id}/posts/post_{post_number}_thumbnail.jpg",
+                thumbnail,
                 post_data.get('transcription', None), post_data.get('date', datetime.now()),
                 post_data.get('original_url', ''), post_data.get('instagram_shortcode', '')
             ))
@@ -408,272 +633,1531 @@ def save_post_to_database(connection, agent_id, post_data, post_number):
             connection.commit()
             print(f"✅ Post saved with title: {title}")
             return post_id
+        finally:
+            cursor.close()
 
+    try:
+        return db.run(insert)
     except Error as e:
         if "Duplicate entry" in str(e):
             return "duplicate"
         else:
             print(f"❌ Error saving post: {e}")
-            connection.rollback()
             return None
-    finally:
-        if cursor:
-            cursor.close()
 
-def download_and_process_media(post, post_folder, post_number, download_folder):
-    """Download and process media files - OPTIMIZED"""
+class DatabaseWriteBuffer:
+    """Write-behind buffer for posts and filtered_posts rows.
+
+    Rows are grouped into multi-row INSERT ... ON DUPLICATE KEY UPDATE
+    statements; posts already stored for their agent are left out of the
+    batch. A background thread flushes once max_rows rows are waiting or
+    every max_delay seconds. Call flush()/close() to force pending rows out.
+
+    Rows that can never be written (bad data, or a post another row already
+    holds) are not retried; they are recorded per agent and shortcode until
+    collected with take_rejected(), so the caller stops counting them as saved.
+    """
+
+    POSTS_COLUMNS = "(id, agent_id, title, content, caption, thumbnail, transcription, date, original_url, instagram_shortcode, created_at)"
+    POSTS_ROW = "(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, NOW())"
+    FILTERED_COLUMNS = "(agent_id, instagram_shortcode, filter_reason)"
+    FILTERED_ROW = "(%s, %s, %s)"
+
+    def __init__(self, db, max_rows=None, max_delay=None):
+        self.db = db
+        self.max_rows = max_rows or DB_WRITE_BUFFER_CONFIG['max_rows']
+        self.max_delay = max_delay or DB_WRITE_BUFFER_CONFIG['max_delay']
+        self._posts = []
+        self._filtered = []
+        # Runs (RunMetrics) with rows waiting; the flush thread has no run of
+        # its own, so flush timings are charged to these
+        self._runs = set()
+        # {(agent_id, shortcode): reason} of rows dropped for good
+        self._rejected = {}
+        self._lock = Lock()
+        self._flush_lock = Lock()
+        self._wakeup = Event()
+        self._closed = Event()
+        self._thread = Thread(target=self._flush_loop, name="db-write-buffer", daemon=True)
+        self._thread.start()
+
+    def add_post(self, row):
+        self._add(self._posts, row)
+
+    def add_filtered_post(self, agent_id, shortcode, reason):
+        self._add(self._filtered, (agent_id, shortcode, reason))
+
+    def _add(self, rows, row):
+        run = current_run.get()
+        with self._lock:
+            rows.append(row)
+            if run is not None:
+                self._runs.add(run)
+            pending = len(self._posts) + len(self._filtered)
+        if pending >= self.max_rows:
+            self._wakeup.set()
+
+    def _flush_loop(self):
+        while not self._closed.is_set():
+            self._wakeup.wait(self.max_delay)
+            self._wakeup.clear()
+            self.flush()
+
+    @staticmethod
+    def _new_posts(cursor, rows):
+        """Split rows into those to insert and those another post already holds
+
+        A row is new when its (agent_id, shortcode) is neither in the posts
+        table nor earlier in the batch. Checked inside the insert operation,
+        so a retried flush whose first commit did reach the database finds
+        its own rows (same id) and neither writes nor rejects them.
+        """
+        keys = list({(row[1], row[9]) for row in rows})
+        cursor.execute(
+            f"SELECT id, agent_id, instagram_shortcode FROM posts "
+            f"WHERE (agent_id, instagram_shortcode) IN ({', '.join(['(%s, %s)'] * len(keys))})",
+            [value for key in keys for value in key]
+        )
+        stored = {(agent_id, shortcode): post_id for post_id, agent_id, shortcode in cursor.fetchall()}
+        new_rows, duplicates = [], []
+        for row in rows:
+            key = (row[1], row[9])
+            if key not in stored:
+                stored[key] = row[0]
+                new_rows.append(row)
+            elif stored[key] != row[0]:
+                duplicates.append(row)
+        return new_rows, duplicates
+
+    def _insert_many(self, table, columns, row_sql, rows, on_duplicate):
+        """Insert rows in one statement; returns the posts rows left out as duplicates"""
+        def insert(connection):
+            cursor = connection.cursor()
+            try:
+                rows_to_insert, duplicates = self._new_posts(cursor, rows) if table == "posts" else (rows, [])
+                if rows_to_insert:
+                    cursor.execute(
+                        f"INSERT INTO {table} {columns} VALUES {', '.join([row_sql] * len(rows_to_insert))} "
+                        f"ON DUPLICATE KEY UPDATE {on_duplicate}",
+                        [value for row in rows_to_insert for value in row]
+                    )
+                connection.commit()
+                return duplicates
+            finally:
+                cursor.close()
+
+        return self.db.run(insert)
+
+    def _write(self, table, columns, row_sql, rows, on_duplicate):
+        """Write rows in one statement
+
+        Returns the rows to retry on the next flush and the rows that can
+        never be written, as (row, reason) pairs.
+        """
+        try:
+            duplicates = self._insert_many(table, columns, row_sql, rows, on_duplicate)
+            return [], [(row, "duplicate post") for row in duplicates]
+        except (errors.OperationalError, errors.InterfaceError) as e:
+            print(f"⚠️ Could not flush {len(rows)} {table} rows, will retry: {e}")
+            return rows, []
+        except Error as e:
+            # One bad row should not take the whole batch down with it
+            print(f"⚠️ Batched insert into {table} failed ({e}), retrying row by row")
+            failed, rejected = [], []
+            for row in rows:
+                try:
+                    duplicates = self._insert_many(table, columns, row_sql, [row], on_duplicate)
+                    rejected.extend((duplicate, "duplicate post") for duplicate in duplicates)
+                except (errors.OperationalError, errors.InterfaceError):
+                    failed.append(row)
+                except Error as row_error:
+                    rejected.append((row, str(row_error)))
+            return failed, rejected
+
+    def take_rejected(self, agent_id):
+        """Shortcodes of the agent's rows dropped for good since the last call, with the reason"""
+        with self._lock:
+            rejected = {shortcode: reason for (row_agent_id, shortcode), reason in self._rejected.items()
+                        if row_agent_id == agent_id}
+            for shortcode in rejected:
+                del self._rejected[(agent_id, shortcode)]
+        return rejected
+
+    def flush(self):
+        """Write all pending rows; returns True when nothing is left pending"""
+        with self._flush_lock:
+            with self._lock:
+                posts, self._posts = self._posts, []
+                filtered, self._filtered = self._filtered, []
+                runs, self._runs = self._runs, set()
+            if not posts and not filtered:
+                return True
+
+            failed_posts = failed_filtered = rejected_posts = rejected_filtered = []
+            started = time.perf_counter()
+            with span("db flush", **{'db.rows': len(posts) + len(filtered)}):
+                if posts:
+                    failed_posts, rejected_posts = self._write(
+                        "posts", self.POSTS_COLUMNS, self.POSTS_ROW, posts, "id = id")
+                if filtered:
+                    failed_filtered, rejected_filtered = self._write(
+                        "filtered_posts", self.FILTERED_COLUMNS, self.FILTERED_ROW, filtered, "id = id")
+            observe('db_flush', time.perf_counter() - started, runs=runs)
+
+            # posts rows are (id, agent_id, ..., shortcode), filtered rows (agent_id, shortcode, reason)
+            rejected = {(row[1], row[9]): reason for row, reason in rejected_posts}
+            rejected.update({(row[0], row[1]): reason for row, reason in rejected_filtered})
+            for (_, shortcode), reason in rejected.items():
+                print(f"❌ Dropping row of post {shortcode}: {reason}")
+
+            written = (len(posts) - len(failed_posts) - len(rejected_posts) +
+                       len(filtered) - len(failed_filtered) - len(rejected_filtered))
+            if written:
+                print(f"💾 Flushed {written} rows to the database")
+
+            with self._lock:
+                self._rejected.update(rejected)
+                self._posts[:0] = failed_posts
+                self._filtered[:0] = failed_filtered
+                if failed_posts or failed_filtered:
+                    self._runs |= runs
+                return not (self._posts or self._filtered)
+
+    def close(self):
+        """Stop the background thread and flush what is left"""
+        self._closed.set()
+        self._wakeup.set()
+        self._thread.join()
+        if not self.flush():
+            with self._lock:
+                print(f"❌ {len(self._posts)} posts and {len(self._filtered)} filtered rows could not be saved")
+
+def _expected_total_size(response):
+    """Full file size announced by a 200 or 206 response, None when unknown or unparsable"""
+    content_range = response.headers.get('Content-Range', '')
+    try:
+        if '/' in content_range and not content_range.endswith('/*'):
+            return int(content_range.rsplit('/', 1)[1])
+        if response.status_code == 200 and response.headers.get('Content-Length'):
+            return int(response.headers['Content-Length'])
+    except ValueError:
+        pass
+    return None
+
+def _range_start(response):
+    """First byte offset of a 206 response's Content-Range, None when unparsable"""
+    match = re.match(r'bytes (\d+)-', response.headers.get('Content-Range', ''))
+    return int(match.group(1)) if match else None
+
+def _response_validator(response):
+    """Strong ETag or Last-Modified of response, usable in If-Range; None when it has neither"""
+    etag = response.headers.get('ETag', '')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return response.headers.get('Last-Modified') or None
+
+def _read_validator(part_path):
     try:
-        thumbnail_response = requests.get(post.url, timeout=15)
-        if thumbnail_response.status_code == 200:
-            thumbnail_path = os.path.join(post_folder, f"post_{post_number}_thumbnail.jpg")
-            with open(thumbnail_path, 'wb') as f:
-                f.write(thumbnail_response.content)
-
-        video_processed = False
-        for file in os.listdir(download_folder):
-            if file.endswith('.mp4') and 'UTC' in file:
-                old_video_path = os.path.join(download_folder, file)
-                new_video_path = os.path.join(post_folder, f"post_{post_number}_video.mp4")
-                shutil.move(old_video_path, new_video_path)
-                video_processed = True
+        with open(f"{part_path}.validator", 'r', encoding='utf-8') as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+def _save_validator(part_path, validator):
+    if validator:
+        with open(f"{part_path}.validator", 'w', encoding='utf-8') as f:
+            f.write(validator)
+    elif os.path.exists(f"{part_path}.validator"):
+        os.remove(f"{part_path}.validator")
+
+def _discard_partial(part_path):
+    for path in (part_path, f"{part_path}.validator"):
+        if os.path.exists(path):
+            os.remove(path)
+
+def _retry_after_seconds(response):
+    value = response.headers.get('Retry-After', '')
+    return float(value) if value.isdigit() else None
+
+def download_media_file(url, destination, session=None, retries=None, limiter=None):
+    """Stream url to destination with constant memory; returns True on success
+
+    Bytes are written to destination + ".part" and renamed into place only when
+    complete. After a dropped connection the next attempt asks for the missing
+    bytes with an HTTP Range request instead of starting over. The resume is
+    guarded with If-Range and the ETag/Last-Modified saved next to the part
+    file, so bytes of a changed file are never appended; a part file without
+    a saved validator is discarded.
+    """
+    session = session or media_session
+    retries = retries or MEDIA_DOWNLOAD_CONFIG['retries']
+    limiter = limiter or media_rate_limiter
+    part_path = f"{destination}.part"
+
+    for attempt in range(1, retries + 1):
+        limiter.acquire()
+        resume_from = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        validator = _read_validator(part_path) if resume_from else None
+        if resume_from and not validator:
+            _discard_partial(part_path)
+            resume_from = 0
+        headers = {'Range': f"bytes={resume_from}-", 'If-Range': validator} if resume_from else {}
+
+        try:
+            with session.get(url, stream=True, timeout=MEDIA_DOWNLOAD_CONFIG['timeout'], headers=headers) as response:
+                if response.status_code == 416 and resume_from:
+                    # Nothing left to send: either the part is already complete or it is stale
+                    if _expected_total_size(response) == resume_from:
+                        os.replace(part_path, destination)
+                        _discard_partial(part_path)
+                        return True
+                    _discard_partial(part_path)
+                    continue
+
+                if response.status_code == 429:
+                    # The limiter pauses every download, not just this one
+                    limiter.on_throttle(_retry_after_seconds(response))
+                    continue
+
+                if response.status_code not in (200, 206):
+                    print(f"⚠️ Media download failed (HTTP {response.status_code}): {url[:80]}")
+                    if response.status_code < 500:
+                        return False
+                    time.sleep(min(2 ** attempt, 30))
+                    continue
+
+                if response.status_code == 206 and (not resume_from or _range_start(response) != resume_from):
+                    # Not the continuation that was asked for
+                    _discard_partial(part_path)
+                    raise requests.ConnectionError("unexpected partial content, restarting")
+
+                # A 200 means the server ignored the Range header or the file
+                # changed (If-Range did not match), so start from scratch
+                mode = 'ab' if response.status_code == 206 else 'wb'
+                expected_size = _expected_total_size(response)
+                if mode == 'wb':
+                    _save_validator(part_path, _response_validator(response))
+
+                with open(part_path, mode) as f:
+                    for chunk in response.iter_content(chunk_size=MEDIA_DOWNLOAD_CONFIG['chunk_size']):
+                        if chunk:
+                            f.write(chunk)
+                            add_counter('bytes_downloaded', len(chunk))
+
+            if expected_size is not None and os.path.getsize(part_path) < expected_size:
+                raise requests.ConnectionError(f"incomplete download ({os.path.getsize(part_path)}/{expected_size} bytes)")
+
+            os.replace(part_path, destination)
+            _discard_partial(part_path)
+            return True
+
+        except requests.RequestException as e:
+            if attempt == retries:
+                print(f"⚠️ Media download failed after {retries} attempts: {e}")
                 break
+            print(f"⚠️ Media download interrupted ({e}), resuming ({attempt}/{retries})...")
+            time.sleep(min(2 ** attempt, 30) * random.uniform(0.5, 1.0))
+
+    return False
 
-        return video_processed, new_video_path if video_processed else None
+def download_and_process_media(post, post_folder, media_label, download_folder):
+    """Download and process media files - OPTIMIZED"""
+    try:
+        thumbnail_path = os.path.join(post_folder, f"post_{media_label}_thumbnail.jpg")
+        download_media_file(post.url, thumbnail_path)
+
+        # Instaloader names videos post_{label}.mp4, or post_{label}_{n}.mp4 in sidecars;
+        # the first one becomes the post video, renamed within the same folder
+        video_files = sorted(
+            file for file in os.listdir(download_folder)
+            if file.endswith('.mp4') and file.startswith(f"post_{media_label}")
+            and not file.endswith('_video.mp4')
+        )
+        if not video_files:
+            return False, None
+
+        new_video_path = os.path.join(post_folder, f"post_{media_label}_video.mp4")
+        os.replace(os.path.join(download_folder, video_files[0]), new_video_path)
+        for extra_video in video_files[1:]:
+            os.remove(os.path.join(download_folder, extra_video))
+
+        return True, new_video_path
 
     except Exception as e:
         print(f"⚠️ Error downloading media: {e}")
         return False, None
 
-def transcribe_video_optimized(video_path):
-    """Transcribe video with optimized settings"""
-    if not elevenlabs:
-        return None
+def publish_post_files(storage, agent_id, post_folder, post_number):
+    """Publish a saved post's staged files under their post_{number}_* names
+
+    Returns the public URL of every published file, keyed by its public name.
+    Other staged files (extracted audio, Instaloader leftovers) are not
+    published and are removed with the staging folder.
+    """
+    urls = {}
+    skipped = []
+
+    # The thumbnail goes last: once it is visible, the rest of the post is too
+    for file in sorted(os.listdir(post_folder), key=lambda name: name.endswith('_thumbnail.jpg')):
+        if file.endswith('_thumbnail.jpg'):
+            public_name = f"post_{post_number}_thumbnail.jpg"
+        elif file.endswith('_video.mp4'):
+            public_name = f"post_{post_number}_video.mp4"
+        elif file.endswith('.txt'):
+            public_name = f"post_{post_number}_{file}"
+        else:
+            skipped.append(file)
+            continue
+        urls[public_name] = storage.publish(os.path.join(post_folder, file), post_media_key(agent_id, public_name))
 
-    try:
-        with open(video_path, 'rb') as f:
-            audio_data = BytesIO(f.read())
+    if skipped:
+        print(f"⏭️  Not published for post {post_number}: {', '.join(sorted(skipped))}")
 
-        transcription = elevenlabs.speech_to_text.convert(
-            file=audio_data,
-            model_id="scribe_v1",
-            language_code="fas"
-        )
+    shutil.rmtree(post_folder, ignore_errors=True)
+    return urls
 
-        return transcription.text.strip()
+def extract_audio_for_transcription(video_path):
+    """Demux the audio track into a mono low-bitrate Opus file next to the video
 
-    except Exception as e:
-        print(f"⚠️ Transcription failed: {e}")
+    Returns the audio path, or None when ffmpeg is unavailable or fails so the
+    caller can fall back to uploading the video itself.
+    """
+    ffmpeg = AUDIO_EXTRACTION_CONFIG['ffmpeg']
+    if not AUDIO_EXTRACTION_CONFIG['enabled'] or not ffmpeg:
         return None
 
-def process_single_post(post, agent_id, connection, download_folder, current_post_number, existing_shortcodes, filtered_shortcodes, profile_data, username):
-    """Process a single post - WITH AI TRANSCRIPTION CLEANING AND TITLE GENERATION"""
-    post_shortcode = post.shortcode
-
-    if post_shortcode in existing_shortcodes or post_shortcode in filtered_shortcodes:
-        return None, "skipped"
+    audio_path = f"{os.path.splitext(video_path)[0]}_audio.ogg"
+    command = [
+        ffmpeg, '-nostdin', '-loglevel', 'error', '-y',
+        '-i', video_path,
+        '-vn', '-ac', '1', '-ar', AUDIO_EXTRACTION_CONFIG['sample_rate'],
+        '-c:a', 'libopus', '-b:a', AUDIO_EXTRACTION_CONFIG['bitrate'], '-application', 'voip',
+        audio_path
+    ]
 
     try:
-        post_folder_name = f"post_{current_post_number}_{post.date_utc.strftime('%Y%m%d_%H%M%S')}_{post_shortcode}"
-        post_folder = os.path.join(download_folder, post_folder_name)
+        subprocess.run(command, check=True, capture_output=True, timeout=120)
+    except (subprocess.SubprocessError, OSError) as e:
+        print(f"⚠️ Audio extraction failed, uploading video instead: {e}")
+        if os.path.exists(audio_path):
+            os.remove(audio_path)
+        return None
 
-        with file_lock:
-            os.makedirs(post_folder, exist_ok=True)
+    if not os.path.exists(audio_path) or os.path.getsize(audio_path) == 0:
+        return None
 
-        # EXACT WORKING METHOD FROM YOUR ORIGINAL CODE
-        ig = instaloader.Instaloader(
-            download_videos=True,
-            download_video_thumbnails=False,
-            download_geotags=False,
-            download_comments=False,
-            save_metadata=False,
-            compress_json=False,
-            post_metadata_txt_pattern=""
-        )
+    return audio_path
 
-        cookies = browser_cookie3.chrome(domain_name="instagram.com")
-        ig.context._session.cookies.update(cookies)
+def transcribe_video_optimized(video_path):
+    """Transcribe video with optimized settings
 
-        ig.download_post(post, target=download_folder)
+    Transcripts are cached by a hash of the video bytes, so reposted reels and
+    re-runs after a failure are never uploaded to ElevenLabs twice. Returns
+    None when ElevenLabs rejects the file or hears no speech; raises when
+    ElevenLabs is unavailable (open circuit, retries used up, key refused),
+    so the post fails and is retried instead of being filtered for good.
+    """
+    model_id = "scribe_v1"
+    language_code = "fas"
 
-        video_processed, video_path = download_and_process_media(post, post_folder, current_post_number, download_folder)
+    try:
+        cache = get_default_cache()
+        cache_key = content_key("elevenlabs", model_id, language_code, file_digest(video_path))
+        cached = cache.get('transcription', cache_key)
+        if cached:
+            print("♻️ Using cached transcription")
+            return cached['text']
+    except Exception as e:
+        print(f"⚠️ Transcription cache unavailable: {e}")
+        cache = None
 
-        if not video_processed:
-            add_to_filtered_posts(connection, agent_id, post_shortcode, "image_only_no_video")
-            return None, "filtered"
+    if not elevenlabs:
+        return None
+
+    with timed('audio_extract'):
+        audio_path = extract_audio_for_transcription(video_path)
 
-        # Step 1: Get original transcription from ElevenLabs
-        original_transcription = transcribe_video_optimized(video_path)
+    upload_path = audio_path or video_path
+    content_type = "audio/ogg" if audio_path else "video/mp4"
 
-        if not original_transcription:
-            add_to_filtered_posts(connection, agent_id, post_shortcode, "transcription_failed")
-            return None, "filtered"
+    try:
+        # Hand the open file to the client so the multipart body is streamed
+        # from disk in chunks instead of holding the whole file in memory.
+        # Every retry reopens it, so an attempt never starts mid-file.
+        def convert():
+            with open(upload_path, 'rb') as f:
+                return elevenlabs.speech_to_text.convert(
+                    file=(os.path.basename(upload_path), f, content_type),
+                    model_id=model_id,
+                    language_code=language_code
+                )
 
-        persian_char_count = count_persian_characters(original_transcription)
+        transcription = get_gateway('elevenlabs').call(convert)
+        add_counter('bytes_uploaded', os.path.getsize(upload_path))
 
-        if persian_char_count < 50:
-            add_to_filtered_posts(connection, agent_id, post_shortcode, f"insufficient_persian_chars_{persian_char_count}")
-            return None, "filtered"
+        text = transcription.text.strip()
 
-        # Step 2: Clean transcription with AI
-        cleaned_transcription = clean_transcription_with_ai(original_transcription)
+        if cache and text:
+            cache.set('transcription', cache_key, {
+                'text': text,
+                'model_id': model_id,
+                'language_code': language_code,
+                'source_file': os.path.basename(video_path),
+                'source_bytes': os.path.getsize(video_path),
+                'transcribed_at': datetime.now().isoformat()
+            })
 
-        # Save both original and cleaned transcriptions
-        with open(os.path.join(post_folder, "transcription_original.txt"), 'w', encoding='utf-8') as f:
-            f.write(original_transcription)
+        return text
 
-        with open(os.path.join(post_folder, "transcription_cleaned.txt"), 'w', encoding='utf-8') as f:
-            f.write(cleaned_transcription)
+    except Exception as e:
+        if is_provider_unavailable(e):
+            print(f"⚠️ ElevenLabs unavailable, leaving the post for a retry: {e}")
+            raise
+        print(f"⚠️ Transcription failed: {e}")
+        return None
+    finally:
+        if audio_path and os.path.exists(audio_path):
+            os.remove(audio_path)
+
+def build_post_caption(post):
+    """Build the stored caption text including mentions and hashtags"""
+    caption = post.caption if post.caption else "بدون کپشن"
+    if post.caption_mentions:
+        caption += f"\n\n👥 منشن‌ها: {', '.join([f'@{mention}' for mention in post.caption_mentions])}"
+    if post.caption_hashtags:
+        caption += f"\n\n🏷️ هشتگ‌ها: {', '.join([f'#{hashtag}' for hashtag in post.caption_hashtags])}"
+    return caption
+
+def create_pipeline_context(agent_id, db, download_folder, existing_shortcodes, filtered_shortcodes, profile_data, username, next_post_number, write_buffer=None, instaloader_provider=None, storage=None, journal=None):
+    """Shared state for all stages working on one profile"""
+    return {
+        'agent_id': agent_id,
+        'db': db,
+        'write_buffer': write_buffer,
+        'storage': storage or create_media_storage(),
+        'journal': journal,
+        'instaloader': instaloader_provider,
+        'download_folder': download_folder,
+        'existing_shortcodes': existing_shortcodes,
+        'filtered_shortcodes': filtered_shortcodes,
+        'profile_data': profile_data,
+        'username': username,
+        'agent_name': profile_data['full_name'] or username,
+        'next_post_number': next_post_number,
+        'number_lock': Lock()
+    }
+
+def prune_staging_folder(download_folder, resumable_jobs):
+    """Remove the post folders in download_folder that no resumable job needs
+
+    Folders of failed posts that never finished downloading, and any left
+    behind by earlier runs, would otherwise pile up while the staging
+    folder is kept for the posts that can be resumed.
+    """
+    keep = {job['folder_name'] for job in resumable_jobs}
+    for name in os.listdir(download_folder):
+        path = os.path.join(download_folder, name)
+        if name not in keep and os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+
+def create_post_job(post, download_folder):
+    """Create the work item that travels through the pipeline stages"""
+    # Working folders are keyed by shortcode; the final post number is only
+    # assigned when the post is persisted so filtered posts leave no gaps.
+    folder_name = f"{post.date_utc.strftime('%Y%m%d_%H%M%S')}_{post.shortcode}"
+    return {
+        'post': post,
+        'shortcode': post.shortcode,
+        'date': post.date_utc,
+        'folder_name': folder_name,
+        'post_folder': os.path.join(download_folder, folder_name),
+        'completed': set()
+    }
+
+def start_post_span(job, context, resumed=False):
+    """Open the span covering a post's whole way through the pipeline, ended by finish_post_span"""
+    job['span'] = Span('post', current_span.get(), {
+        'post.shortcode': job['shortcode'],
+        'agent.id': context['agent_id'],
+        'profile.username': context['username'],
+        'post.resumed': resumed
+    })
+
+def finish_post_span(job, status):
+    post_span = job.get('span')
+    if post_span:
+        post_span.set_attribute('post.status', status)
+        if status not in ("success", "filtered"):
+            post_span.set_error(f"{status} at stage {job.get('final_stage')}")
+        post_span.end()
+
+def run_stage(stage_name, stage, job, context):
+    """Run one stage of a job, timed and traced as a child of the post's span"""
+    with timed(stage_name, job['shortcode']), \
+            span(f"stage {stage_name}", job.get('span'), **{'post.shortcode': job['shortcode']}) as stage_span:
+        status = stage(job, context)
+        if status:
+            stage_span.set_attribute('stage.result', status)
+        return status
+
+class CheckpointJournal:
+    """Append-only JSONL journal of per-post progress, kept in the staging folder.
+
+    After every completed stage a post's record is rewritten with the stages
+    done so far and what later stages need (video path, caption,
+    transcriptions, title, published media). A resumed run continues each
+    unfinished post at its next stage instead of starting over. Posts found
+    in the database are finished; the journal is compacted when opened.
+    """
+
+    FIELDS = ('folder_name', 'caption', 'video_path', 'original_transcription',
+              'cleaned_transcription', 'title', 'published')
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self._lock = Lock()
+        self._file = None
+
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # Torn last line of a crashed run
+                    self.entries[record['shortcode']] = record
+
+    def open(self, finished_shortcodes):
+        """Forget finished posts, compact the journal and start appending to it"""
+        self.entries = {shortcode: record for shortcode, record in self.entries.items()
+                        if shortcode not in finished_shortcodes}
+
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            for record in self.entries.values():
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        os.replace(temp_path, self.path)
+
+        self._file = open(self.path, 'a', encoding='utf-8')
+
+    def record(self, job):
+        """Checkpoint a job after a stage completed"""
+        record = {
+            'shortcode': job['shortcode'],
+            'date': job['date'].isoformat(),
+            'completed': sorted(job['completed']),
+            **{field: job[field] for field in self.FIELDS if job.get(field) is not None}
+        }
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            self.entries[job['shortcode']] = record
+            if self._file:
+                self._file.write(line)
+                self._file.flush()
+
+    def resumable_jobs(self, download_folder, skip_shortcodes=()):
+        """Jobs for unfinished posts whose media is already downloaded"""
+        jobs = []
+        for shortcode, record in self.entries.items():
+            if shortcode in skip_shortcodes or 'download' not in record['completed']:
+                continue
 
-        # For backward compatibility, also save as transcription.txt (cleaned version)
-        with open(os.path.join(post_folder, "transcription.txt"), 'w', encoding='utf-8') as f:
-            f.write(cleaned_transcription)
+            job = {field: record[field] for field in self.FIELDS if field in record}
+            job.update(
+                post=None,
+                shortcode=shortcode,
+                date=datetime.fromisoformat(record['date']),
+                post_folder=os.path.join(download_folder, record['folder_name']),
+                completed=set(record['completed'])
+            )
 
-        caption = post.caption if post.caption else "بدون کپشن"
-        if post.caption_mentions:
-            caption += f"\n\n👥 منشن‌ها: {', '.join([f'@{mention}' for mention in post.caption_mentions])}"
-        if post.caption_hashtags:
-            caption += f"\n\n🏷️ هشتگ‌ها: {', '.join([f'#{hashtag}' for hashtag in post.caption_hashtags])}"
+            # Stages that still need the staged media can only resume if it is there
+            if 'published' not in job and not os.path.exists(job['post_folder']):
+                continue
+            if 'transcribe' not in job['completed'] and not os.path.exists(job.get('video_path', '')):
+                continue
+            jobs.append(job)
+        return jobs
+
+    def max_post_number(self):
+        """Highest post number already published by a journaled post, 0 if none"""
+        return max((record['published']['post_number'] for record in self.entries.values()
+                    if 'published' in record), default=0)
+
+    def close(self):
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+
+def filter_post(job, context, reason):
+    """Record a post as filtered so later runs skip it"""
+    add_to_filtered_posts(context['db'], context['agent_id'], job['shortcode'], reason, context.get('write_buffer'))
+    return "filtered"
+
+def prefilter_reason(post):
+    """Filter reason from the post's metadata alone, or None when it may hold a usable video
+
+    Runs before anything is downloaded. Sidecars can mix images and videos,
+    so they are only judged after download (see download_and_process_media).
+    """
+    try:
+        typename = post.typename
+        if typename == 'GraphSidecar':
+            return None
+        if typename == 'GraphImage' or not post.is_video:
+            return "image_only_no_video"
+        duration = post.video_duration
+    except Exception as e:
+        print(f"⚠️ Could not read metadata of {post.shortcode}, checking after download: {e}")
+        return None
 
-        with open(os.path.join(post_folder, "caption.txt"), 'w', encoding='utf-8') as f:
-            f.write(caption)
+    if duration is None:
+        return None
+    if duration < POST_FILTER_CONFIG['min_video_seconds']:
+        return f"video_too_short_{int(duration)}s"
+    if POST_FILTER_CONFIG['max_video_seconds'] and duration > POST_FILTER_CONFIG['max_video_seconds']:
+        return f"video_too_long_{int(duration)}s"
+    return None
+
+def stage_download_media(job, context):
+    """Stage 1: download the post's video and thumbnail into its staging folder"""
+    # Requests for the post go through this worker's session, not the listing thread's
+    post = context['instaloader'].bind(job['post'])
+    post_folder = job['post_folder']
+
+    with file_lock:
+        os.makedirs(post_folder, exist_ok=True)
+
+    # Instaloader writes the video straight into the post's staging folder.
+    # The instance belongs to this worker thread, so pointing it at the
+    # folder cannot affect other downloads.
+    ig = context['instaloader'].get()
+    ig.dirname_pattern = post_folder
+    ig.filename_pattern = f"post_{job['shortcode']}"
+
+    # Metadata requests wait on the shared limiter through InstagramRateController,
+    # the video itself is fetched from the CDN
+    media_rate_limiter.acquire()
+    with span("instaloader download_post"):
+        call_with_backoff(
+            lambda: ig.download_post(post, target=context['username']),
+            instagram_rate_limiter, INSTAGRAM_THROTTLE_ERRORS,
+            INSTAGRAM_RATE_CONFIG['retries'], acquire=False
+        )
 
-        # Step 3: Generate AI title based on cleaned content
-        print(f"🤖 Generating unique AI title for post {current_post_number}...")
-        ai_title = generate_persian_title_with_ai(
-            cleaned_transcription,
-            caption,
-            profile_data['full_name'] or username
+    with span("thumbnail download"):
+        video_processed, video_path = download_and_process_media(post, post_folder, job['shortcode'], post_folder)
+
+    if not video_processed:
+        return filter_post(job, context, "image_only_no_video")
+
+    job['video_path'] = video_path
+    job['caption'] = build_post_caption(post)
+    add_counter('bytes_downloaded', os.path.getsize(video_path))
+
+    with open(os.path.join(post_folder, "caption.txt"), 'w', encoding='utf-8') as f:
+        f.write(job['caption'])
+
+def stage_transcribe(job, context):
+    """Stage 2: transcribe the video with ElevenLabs and apply the Persian filter
+
+    An ElevenLabs outage raises out of the stage, so the post fails and is
+    retried; only an empty or rejected transcription filters it.
+    """
+    original_transcription = transcribe_video_optimized(job['video_path'])
+
+    if not original_transcription:
+        return filter_post(job, context, "transcription_failed")
+
+    persian_char_count = count_persian_characters(original_transcription)
+
+    if persian_char_count < 50:
+        return filter_post(job, context, f"insufficient_persian_chars_{persian_char_count}")
+
+    job['original_transcription'] = original_transcription
+
+    with open(os.path.join(job['post_folder'], "transcription_original.txt"), 'w', encoding='utf-8') as f:
+        f.write(original_transcription)
+
+def stage_clean_transcription(job, context):
+    """Stage 3: clean the transcription with AI (and title it, in single-call mode)"""
+    if enrichment_engine and enrichment_engine.single_call:
+        cleaned_transcription, job['title'] = enrich_transcription_with_ai(job['original_transcription'], job['caption'])
+    else:
+        cleaned_transcription = clean_transcription_with_ai(job['original_transcription'])
+    job['cleaned_transcription'] = cleaned_transcription
+
+    with open(os.path.join(job['post_folder'], "transcription_cleaned.txt"), 'w', encoding='utf-8') as f:
+        f.write(cleaned_transcription)
+
+    # For backward compatibility, also save as transcription.txt (cleaned version)
+    with open(os.path.join(job['post_folder'], "transcription.txt"), 'w', encoding='utf-8') as f:
+        f.write(cleaned_transcription)
+
+def stage_generate_title(job, context):
+    """Stage 4: generate a Persian title based on the cleaned content"""
+    if 'title' in job:
+        return  # Generated together with the cleaned text
+    print(f"🤖 Generating unique AI title for post {job['shortcode']}...")
+    ai_title = generate_persian_title_with_ai(
+        job['cleaned_transcription'],
+        job['caption'],
+        context['agent_name']
+    )
+
+    if ai_title:
+        print(f"✅ Generated unique title: {ai_title}")
+    else:
+        print(f"⚠️ AI title generation failed, will use enhanced fallback")
+    job['title'] = ai_title
+
+def stage_persist(job, context):
+    """Stage 5: assign the post number, publish the post's files and save it"""
+    # Use cleaned transcription for database content
+    post_data = {
+        'title': job['title'],  # Pass the AI-generated title
+        'content': job['cleaned_transcription'],  # Using cleaned version
+        'caption': job['caption'],
+        'transcription': job['cleaned_transcription'],  # Using cleaned version
+        'date': job['date'],
+        'original_url': f"https://instagram.com/p/{job['shortcode']}",
+        'instagram_shortcode': job['shortcode'],
+        'agent_name': context['agent_name']
+    }
+
+    # Reserve the number, then upload outside the lock so persist workers
+    # publish concurrently; the row is written once its media URLs exist.
+    # A resumed post whose files were already published keeps its number.
+    if not job.get('published'):
+        with context['number_lock']:
+            post_number = context['next_post_number']
+            context['next_post_number'] += 1
+
+        with timed('publish', job['shortcode']):
+            urls = publish_post_files(context['storage'], context['agent_id'], job['post_folder'], post_number)
+        # posts only has a thumbnail column; every URL is kept in the journal and the result
+        job['published'] = {'post_number': post_number, 'thumbnail': urls.get(f"post_{post_number}_thumbnail.jpg"),
+                            'urls': urls}
+        if context.get('journal'):
+            context['journal'].record(job)
+
+    post_number = job['published']['post_number']
+    post_data['thumbnail'] = job['published']['thumbnail']
+
+    with timed('db_write', job['shortcode']):
+        post_id = save_post_to_database(
+            context['db'], context['agent_id'], post_data, post_number, context.get('write_buffer')
         )
-        
-        if ai_title:
-            print(f"✅ Generated unique title: {ai_title}")
-        else:
-            print(f"⚠️ AI title generation failed, will use enhanced fallback")
-        # Use cleaned transcription for database content
-        post_data = {
-            'title': ai_title,  # Pass the AI-generated title
-            'content': cleaned_transcription,  # Using cleaned version
-            'caption': caption,
-            'transcription': cleaned_transcription,  # Using cleaned version
-            'date': post.date_utc,
-            'original_url': f"https://instagram.com/p/{post_shortcode}",
-            'instagram_shortcode': post_shortcode,
-            'agent_name': profile_data['full_name'] or username
-        }
+    if not post_id or post_id == "duplicate":
+        return "failed"
+
+    job['result'] = {
+        'post_number': post_number,
+        'folder_name': job['folder_name'],
+        'post_id': post_id,
+        'shortcode': job['shortcode'],
+        'media_urls': job['published'].get('urls', {})
+    }
+    return "success"
+
+# Stage order of the per-post pipeline. A stage returns None to hand the job
+# to the next stage, or a final status ("filtered", "failed", "success").
+PIPELINE_STAGES = (
+    ('download', stage_download_media),
+    ('transcribe', stage_transcribe),
+    ('clean', stage_clean_transcription),
+    ('title', stage_generate_title),
+    ('persist', stage_persist),
+)
+
+def process_single_post(post, agent_id, db, download_folder, current_post_number, existing_shortcodes, filtered_shortcodes, profile_data, username, instaloader_provider=None, storage=None):
+    """Process a single post - WITH AI TRANSCRIPTION CLEANING AND TITLE GENERATION"""
+    post_shortcode = post.shortcode
 
-        post_id = save_post_to_database(connection, agent_id, post_data, current_post_number)
+    if post_shortcode in existing_shortcodes or post_shortcode in filtered_shortcodes:
+        return None, "skipped"
+
+    instaloader_provider = instaloader_provider or get_default_instaloader_provider()
 
-        if post_id and post_id != "duplicate":
-            return {
-                'post_number': current_post_number,
-                'folder_name': post_folder_name,
-                'post_id': post_id,
-                'shortcode': post_shortcode
-            }, "success"
+    context = create_pipeline_context(
+        agent_id, db, download_folder, existing_shortcodes,
+        filtered_shortcodes, profile_data, username, current_post_number,
+        instaloader_provider=instaloader_provider, storage=storage
+    )
+    job = create_post_job(post, download_folder)
+    start_post_span(job, context)
+    status = "failed"
 
-        return None, "failed"
+    try:
+        for stage_name, stage in PIPELINE_STAGES:
+            job['final_stage'] = stage_name
+            status = run_stage(stage_name, stage, job, context)
+            if status:
+                return job.get('result'), status
+        status = "failed"
+        return None, status
 
     except Exception as e:
         print(f"❌ Error processing post {post_shortcode}: {e}")
+        status = "error"
         return None, "error"
+    finally:
+        finish_post_span(job, status)
 
-def organize_files_optimized(username, agent_id, downloaded_folder, saved_posts_info):
-    """Organize files with optimized operations"""
+def organize_files_optimized(username, agent_id, downloaded_folder, saved_posts_info, storage=None):
+    """Publish staged files of saved posts that have not been published yet"""
     try:
-        agent_public_dir = f"public/agents/{agent_id}"
-        profile_dir = f"{agent_public_dir}/profile"
-        posts_dir = f"{agent_public_dir}/posts"
-
-        os.makedirs(profile_dir, exist_ok=True)
-        os.makedirs(posts_dir, exist_ok=True)
+        storage = storage or create_media_storage()
 
         profile_pic_source = os.path.join(downloaded_folder, f"{username}_profile.jpg")
         if os.path.exists(profile_pic_source):
-            shutil.copy2(profile_pic_source, os.path.join(profile_dir, "profile_picture.jpg"))
+            storage.publish(profile_pic_source, profile_media_key(agent_id))
 
-        def copy_post_files(post_info):
-            post_number = post_info['post_number']
-            post_folder_name = post_info['folder_name']
-            post_folder_path = os.path.join(downloaded_folder, post_folder_name)
+        for post_info in saved_posts_info:
+            post_folder_path = os.path.join(downloaded_folder, post_info['folder_name'])
+            if os.path.exists(post_folder_path):
+                publish_post_files(storage, agent_id, post_folder_path, post_info['post_number'])
 
-            if not os.path.exists(post_folder_path):
-                return
+        return True
 
-            thumbnail_files = [f for f in os.listdir(post_folder_path) if f.endswith('_thumbnail.jpg')]
-            if thumbnail_files:
-                shutil.copy2(
-                    os.path.join(post_folder_path, thumbnail_files[0]),
-                    os.path.join(posts_dir, f"post_{post_number}_thumbnail.jpg")
-                )
+    except Exception as e:
+        print(f"❌ Error organizing files: {e}")
+        return False
 
-            video_files = [f for f in os.listdir(post_folder_path) if f.endswith('_video.mp4')]
-            if video_files:
-                shutil.copy2(
-                    os.path.join(post_folder_path, video_files[0]),
-                    os.path.join(posts_dir, f"post_{post_number}_video.mp4")
+class PostSlotScheduler:
+    """Global cap on posts in flight across all profiles of a batch.
+
+    Every active profile is entitled to an equal share of the slots. A profile
+    only takes more than its share while others leave slots unused, so one
+    large profile cannot starve the rest of the batch.
+    """
+
+    def __init__(self, max_slots):
+        self.max_slots = max(1, max_slots)
+        self._in_flight = {}
+        self._cond = Condition()
+
+    def register(self, key):
+        with self._cond:
+            self._in_flight.setdefault(key, 0)
+            self._cond.notify_all()
+
+    def unregister(self, key):
+        with self._cond:
+            self._in_flight.pop(key, None)
+            self._cond.notify_all()
+
+    def _fair_share(self):
+        return max(1, math.ceil(self.max_slots / max(1, len(self._in_flight))))
+
+    def acquire(self, key):
+        with self._cond:
+            while (sum(self._in_flight.values()) >= self.max_slots or
+                   self._in_flight.get(key, 0) >= self._fair_share()):
+                self._cond.wait()
+            self._in_flight[key] = self._in_flight.get(key, 0) + 1
+
+    def release(self, key):
+        with self._cond:
+            if self._in_flight.get(key):
+                self._in_flight[key] -= 1
+            self._cond.notify_all()
+
+class PostPipeline:
+    """Staged, concurrent post processor for one profile.
+
+    Posts flow fetch -> download -> transcribe -> clean -> title -> persist.
+    Every stage has its own worker threads and a bounded queue in front of it,
+    so network-bound steps of different posts overlap. The fetch side (run)
+    never keeps more posts in flight than are still needed to reach max_posts.
+    """
+
+    def __init__(self, context, max_posts, workers=None, queue_size=None, scheduler=None):
+        self.context = context
+        self.max_posts = max_posts
+        self.scheduler = scheduler
+        self.workers = {**PIPELINE_CONFIG['workers'], **(workers or {})}
+        queue_size = queue_size or PIPELINE_CONFIG['queue_size']
+
+        self.stages = PIPELINE_STAGES
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in self.stages]
+        self._active_workers = [max(1, self.workers.get(name, 1)) for name, _ in self.stages]
+        self._cond = Condition()
+        self._threads = []
+
+        self.in_flight = 0
+        self.successful_posts = 0
+        self.skipped_posts = 0
+        self.filtered_posts = 0
+        self.failed_posts = 0
+        self.total_checked = 0
+        self.saved_posts_info = []
+        self.failed_shortcodes = []
+
+    def _start_workers(self):
+        for index, (stage_name, _) in enumerate(self.stages):
+            for worker_number in range(self._active_workers[index]):
+                # Each worker runs in a copy of this thread's context, which holds the current metrics run
+                thread = Thread(
+                    target=contextvars.copy_context().run, args=(self._worker, index),
+                    name=f"{stage_name}-{worker_number + 1}", daemon=True
                 )
+                thread.start()
+                self._threads.append(thread)
+
+    def _worker(self, index):
+        stage_name, stage = self.stages[index]
+        in_queue = self.queues[index]
+
+        while True:
+            job = in_queue.get()
+            if job is None:
+                if self.context.get('instaloader'):
+                    self.context['instaloader'].release()
+                self._worker_exited(index)
+                return
 
-            for file in os.listdir(post_folder_path):
-                if file.endswith('.txt'):
-                    shutil.copy2(
-                        os.path.join(post_folder_path, file),
-                        os.path.join(posts_dir, f"post_{post_number}_{file}")
-                    )
-
-        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
-            executor.map(copy_post_files, saved_posts_info)
+            if stage_name in job['completed']:
+                status = None  # Done before the run was interrupted
+            else:
+                try:
+                    status = run_stage(stage_name, stage, job, self.context)
+                except Exception as e:
+                    print(f"❌ Error processing post {job['shortcode']} ({stage_name}): {e}")
+                    status = "error"
+                if status:
+                    job['final_stage'] = stage_name
+
+                if status is None:
+                    job['completed'].add(stage_name)
+                    if self.context.get('journal'):
+                        self.context['journal'].record(job)
+
+            if status is None and index + 1 < len(self.stages):
+                self.queues[index + 1].put(job)
+            else:
+                self._finish(job, status or "failed")
+
+    def _worker_exited(self, index):
+        # The last worker of a stage to shut down passes the shutdown on
+        with self._cond:
+            self._active_workers[index] -= 1
+            last_worker = self._active_workers[index] == 0
+        if last_worker and index + 1 < len(self.stages):
+            for _ in range(self._active_workers[index + 1]):
+                self.queues[index + 1].put(None)
+
+    def _finish(self, job, status):
+        if self.scheduler:
+            self.scheduler.release(self.context['username'])
+        finish_post_span(job, status)
+
+        # A filtered post is never resumed; saved posts lose their folder when published
+        if status == "filtered":
+            shutil.rmtree(job['post_folder'], ignore_errors=True)
+
+        with self._cond:
+            self.in_flight -= 1
+
+            if status == "success" and job.get('result'):
+                self.saved_posts_info.append(job['result'])
+                self.context['existing_shortcodes'].add(job['shortcode'])
+                self.successful_posts += 1
+                add_counter('posts', status="saved")
+                print(f"✅ SAVED: Post {self.successful_posts}/{self.max_posts} (AI cleaned + Persian title)")
+            elif status == "filtered":
+                self.context['filtered_shortcodes'].add(job['shortcode'])
+                self.filtered_posts += 1
+                add_counter('posts', status="filtered")
+                print(f"🚫 FILTERED: Not suitable ({job['shortcode']})")
+            else:
+                self.failed_posts += 1
+                add_counter('posts', status="failed")
+                self.failed_shortcodes.append(job['shortcode'])
+                trace = f" 🔎 trace {job['span'].trace_id}" if TRACING_CONFIG['path'] and job.get('span') else ""
+                print(f"❌ FAILED: Could not process ({job['shortcode']}){trace}")
+
+            self._cond.notify_all()
+
+    def _collect_gauges(self):
+        """Queue depths and posts in flight, read by the metrics exporter on every scrape"""
+        profile = self.context['username']
+        samples = [('scraper_pipeline_queue_depth', {'profile': profile, 'stage': name}, self.queues[index].qsize())
+                   for index, (name, _) in enumerate(self.stages)]
+        samples.append(('scraper_posts_in_flight', {'profile': profile}, self.in_flight))
+        return samples
+
+    def _wait_for_capacity(self):
+        """Block until another post may be dispatched; False once max_posts is reached"""
+        with self._cond:
+            while (self.successful_posts < self.max_posts and
+                   self.successful_posts + self.in_flight >= self.max_posts):
+                self._cond.wait()
+            return self.successful_posts < self.max_posts
+
+    def run(self, posts, resumed_jobs=()):
+        """Feed posts (newest first) into the pipeline and wait for all stages to drain
+
+        Jobs resumed from a checkpoint journal go first and start at the
+        stage after the last one they completed.
+        """
+        existing_shortcodes = self.context['existing_shortcodes']
+        filtered_shortcodes = self.context['filtered_shortcodes']
+        resumed_shortcodes = set()
+
+        self._start_workers()
+        if self.scheduler:
+            self.scheduler.register(self.context['username'])
+        registry.add_collector(id(self), self._collect_gauges)
 
-        return True
+        try:
+            for job in resumed_jobs:
+                if not self._wait_for_capacity():
+                    break
+                resumed_shortcodes.add(job['shortcode'])
+                if self.scheduler:
+                    self.scheduler.acquire(self.context['username'])
+
+                with self._cond:
+                    self.total_checked += 1
+                    self.in_flight += 1
+                    print(f"♻️  RESUMED POST #{self.total_checked} ({self.successful_posts + self.in_flight}/{self.max_posts}): "
+                          f"{job['shortcode']} after {', '.join(sorted(job['completed']))}")
+
+                start_post_span(job, self.context, resumed=True)
+                self.queues[0].put(job)
+
+            # Capacity is checked before the next post is pulled, so the source
+            # never hands out a post that is then dropped (see ProfileSync)
+            posts = iter(posts)
+            while self._wait_for_capacity():
+                with timed('listing'):
+                    post = next(posts, None)
+                if post is None:
+                    break
+
+                post_shortcode = post.shortcode
+                post_date = post.date_utc.strftime('%Y-%m-%d %H:%M')
+
+                if post_shortcode in resumed_shortcodes:
+                    continue
+
+                if post_shortcode in existing_shortcodes:
+                    with self._cond:
+                        self.total_checked += 1
+                        self.skipped_posts += 1
+                        add_counter('posts', status="skipped_existing")
+                        print(f"⏭️  Skip #{self.total_checked} (exists): {post_date}")
+                    continue
+
+                if post_shortcode in filtered_shortcodes:
+                    with self._cond:
+                        self.total_checked += 1
+                        self.filtered_posts += 1
+                        add_counter('posts', status="skipped_filtered")
+                        print(f"🚫 Skip #{self.total_checked} (filtered): {post_date}")
+                    continue
+
+                # Posts that cannot qualify are filtered before any media is fetched
+                with timed('prefilter'):
+                    reason = prefilter_reason(post)
+                if reason:
+                    add_to_filtered_posts(self.context['db'], self.context['agent_id'], post_shortcode,
+                                          reason, self.context.get('write_buffer'))
+                    filtered_shortcodes.add(post_shortcode)
+                    with self._cond:
+                        self.total_checked += 1
+                        self.filtered_posts += 1
+                        add_counter('posts', status="filtered")
+                        print(f"🚫 Skip #{self.total_checked} ({reason}): {post_date}")
+                    continue
+
+                if self.scheduler:
+                    self.scheduler.acquire(self.context['username'])
+
+                with self._cond:
+                    self.total_checked += 1
+                    self.in_flight += 1
+                    print(f"🆕 NEW POST #{self.total_checked} ({self.successful_posts + self.in_flight}/{self.max_posts}): {post_date}")
+
+                job = create_post_job(post, self.context['download_folder'])
+                start_post_span(job, self.context)
+                self.queues[0].put(job)
 
-    except Exception as e:
-        print(f"❌ Error organizing files: {e}")
-        return False
+        finally:
+            for _ in range(self._active_workers[0]):
+                self.queues[0].put(None)
+            for thread in self._threads:
+                thread.join()
+            if self.scheduler:
+                self.scheduler.unregister(self.context['username'])
+            registry.remove_collector(id(self))
+
+        if self.successful_posts >= self.max_posts:
+            print(f"✅ SUCCESS: Got {self.max_posts} new posts, stopping!")
+
+        return {
+            'saved_posts_info': self.saved_posts_info,
+            'successful_posts': self.successful_posts,
+            'skipped_posts': self.skipped_posts,
+            'filtered_posts': self.filtered_posts,
+            'failed_posts': self.failed_posts,
+            'failed_shortcodes': self.failed_shortcodes,
+            'total_checked': self.total_checked
+        }
 
-def download_instagram_profile(username, browser="chrome", max_posts=5):
-    """WORKING Instagram profile downloader WITH AI TRANSCRIPTION CLEANING AND TITLE GENERATION"""
-    print(f"🚀 Instagram scraper with AI cleaning and title generation for @{username}")
-    print("⚡ USING EXACT WORKING METHOD + AI TRANSCRIPTION CLEANING + PERSIAN TITLE GENERATION")
-    print("🤖 AI will clean transcriptions and generate Persian titles for website/blog use")
-    print("📅 POSTS ORDERED: Newest to Oldest")
-    print("=" * 60)
+def discount_rejected_posts(summary, rejected, existing_shortcodes, filtered_shortcodes):
+    """Count posts whose buffered row was rejected at flush time as failed
+
+    The pipeline counted them when their row was queued. As failed posts
+    they hold the sync cursor back and, no longer finished, keep their
+    checkpoint journal entries for the next run.
+    """
+    saved = [info for info in summary['saved_posts_info'] if info['shortcode'] not in rejected]
+    rejected_saved = len(summary['saved_posts_info']) - len(saved)
+    rejected_filtered = len((rejected.keys() & filtered_shortcodes) - existing_shortcodes)
+
+    summary['saved_posts_info'] = saved
+    summary['successful_posts'] -= rejected_saved
+    summary['filtered_posts'] -= rejected_filtered
+    summary['failed_posts'] += rejected_saved + rejected_filtered
+    summary['failed_shortcodes'].extend(shortcode for shortcode in rejected
+                                        if shortcode not in summary['failed_shortcodes'])
+    existing_shortcodes.difference_update(rejected)
+    filtered_shortcodes.difference_update(rejected)
+    add_counter('posts', rejected_saved + rejected_filtered, status="rejected")
+    print(f"❌ {len(rejected)} posts could not be saved to the database: {', '.join(sorted(rejected))}")
+
+class ProfileSync:
+    """Incremental post source for one agent, backed by agent_sync_state.
+
+    Posts come newest first. The head scan stops paginating at the first post
+    that is not newer than the stored high-water mark, so a refresh costs
+    O(new posts). Older history is then backfilled from where the previous
+    run stopped, by thawing its frozen Instaloader iterator (or by walking on
+    from the head, as before, when there is none). The cursor only advances
+    over ranges where every post was saved or filtered, so failed posts are
+    retried by the next run.
+    """
+
+    def __init__(self, profile, state, incremental=None, possibly_pinned=None):
+        self.profile = profile
+        self.state = state
+        incremental = SYNC_CONFIG['incremental'] if incremental is None else incremental
+        self.mark = state['newest_post_date'] if incremental else None
+        self.possibly_pinned = SYNC_CONFIG['possibly_pinned'] if possibly_pinned is None else possibly_pinned
+
+        self.newest = None
+        self.head_shortcodes = set()
+        self.reached_mark = False
+        self.head_exhausted = False
+        self.backfill_iterator = None
+        self.backfill_shortcodes = set()
+        self.backfill_exhausted = False
+
+    def _thaw_backfill(self, unused_iterator):
+        """unused_iterator positioned where the last backfill stopped, or None
+
+        unused_iterator is a not yet consumed copy of the head iterator, so
+        thawing does not cost another get_posts() request.
+        """
+        if not self.state['backfill_cursor']:
+            return None
+        try:
+            frozen = FrozenNodeIterator(**json.loads(self.state['backfill_cursor']))
+            if not frozen.best_before or frozen.best_before < time.time():
+                print("⚠️ Saved backfill position expired, walking older posts instead")
+                return None
+            unused_iterator.thaw(frozen)
+            return unused_iterator
+        except (InvalidArgumentException, TypeError, ValueError) as e:
+            print(f"⚠️ Cannot resume backfill ({e}), walking older posts instead")
+            return None
 
-    # Only add session cleanup - everything else stays the same
-    clear_instaloader_sessions()
+    def posts(self):
+        head = self.profile.get_posts()
+        if self.mark is None:
+            # Full scan: the head scan is also the backfill walk
+            self.backfill_iterator = head
+        # NodeIterator only reassigns its page data, so a shallow copy taken
+        # now can still be thawed after the head scan has moved on
+        unused_head = copy.copy(head)
+
+        listing = iterate_with_backoff(head, instagram_rate_limiter, INSTAGRAM_THROTTLE_ERRORS, INSTAGRAM_RATE_CONFIG['retries'])
+        for number, post in enumerate(listing, start=1):
+            pinned = number <= self.possibly_pinned or post.is_pinned
+            if self.mark and not pinned and post.date_utc <= self.mark:
+                self.reached_mark = True
+                print(f"⏹️  Reached posts synced by the last run ({self.mark:%Y-%m-%d %H:%M})")
+                break
 
-    connection = create_database_connection()
-    if not connection:
-        return
+            self.head_shortcodes.add(post.shortcode)
+            if self.mark is None:
+                self.backfill_shortcodes.add(post.shortcode)
+            if not self.newest or post.date_utc > self.newest.date_utc:
+                self.newest = post
+            yield post
+        else:
+            # The whole profile was listed (the marked post may be gone), so the head is covered too
+            self.head_exhausted = True
+            if self.mark is None:
+                self.backfill_exhausted = True
+            return
 
-    if not ensure_database_structure(connection):
-        return
+        if self.state['backfill_complete']:
+            return
 
-    try:
-        print(f"🍪 Loading cookies from {browser}...")
-        if browser.lower() == "chrome":
-            cookies = browser_cookie3.chrome(domain_name="instagram.com")
-        elif browser.lower() == "safari":
-            cookies = browser_cookie3.safari(domain_name="instagram.com")
+        self.backfill_iterator = self._thaw_backfill(unused_head)
+        if self.backfill_iterator:
+            print("⏩ Resuming backfill of older posts")
         else:
-            cookies = browser_cookie3.chromium(domain_name="instagram.com")
+            self.backfill_iterator = head
+
+        for post in iterate_with_backoff(self.backfill_iterator, instagram_rate_limiter,
+                                         INSTAGRAM_THROTTLE_ERRORS, INSTAGRAM_RATE_CONFIG['retries']):
+            self.backfill_shortcodes.add(post.shortcode)
+            yield post
+        self.backfill_exhausted = True
+
+    def commit(self, db, agent_id, failed_shortcodes=()):
+        """Advance the stored cursor over the ranges this run fully handled"""
+        failed = set(failed_shortcodes)
+        state = dict(self.state)
+
+        head_covered = self.reached_mark or self.head_exhausted or self.mark is None
+        if head_covered and self.newest and not failed & self.head_shortcodes:
+            if not state['newest_post_date'] or self.newest.date_utc > state['newest_post_date']:
+                state['newest_post_date'] = self.newest.date_utc
+                state['newest_shortcode'] = self.newest.shortcode
+
+        if self.backfill_iterator is not None and not failed & self.backfill_shortcodes and not self.state['backfill_complete']:
+            if self.backfill_exhausted:
+                state['backfill_cursor'] = None
+                state['backfill_complete'] = True
+            else:
+                state['backfill_cursor'] = json.dumps(self.backfill_iterator.freeze()._asdict())
+
+        if state != self.state:
+            save_sync_state(db, agent_id, state)
+            self.state = state
+
+class InstagramRateController(instaloader.RateController):
+    """Sends Instaloader's rate limiting through the shared adaptive limiter.
+
+    Instaloader's own controller keeps fixed sliding windows per instance;
+    with one instance per thread none of them sees the total request rate.
+    """
+
+    def __init__(self, context, limiter=None):
+        super().__init__(context)
+        self._limiter = limiter or instagram_rate_limiter
+
+    def wait_before_query(self, query_type):
+        self._limiter.acquire()
+
+    def handle_429(self, query_type):
+        # Instaloader retries right after this returns; the next
+        # wait_before_query waits out the pause
+        self._limiter.on_throttle()
+
+class InstaloaderProvider:
+    """Per-session source of Instaloader instances sharing one set of browser cookies.
+
+    Cookies are read (and decrypted) from the browser once. Every thread that
+    asks for an instance gets its own Instaloader, because their contexts are
+    not thread-safe, and keeps it until it calls release(). Released
+    instances go to the next thread that asks, so the pipeline threads of
+    later profiles reuse the HTTP connections to Instagram of earlier ones.
+    """
+
+    def __init__(self, cookies):
+        self.cookies = cookies
+        self._local = local()
+        self._instances = []
+        self._idle = []
+        self._lock = Lock()
 
+    def create(self):
         # EXACT WORKING METHOD FROM YOUR ORIGINAL CODE
+        # Pictures are skipped: the thumbnail is fetched once by download_media_file
         ig = instaloader.Instaloader(
+            download_pictures=False,
             download_videos=True,
             download_video_thumbnails=False,
             download_geotags=False,
             download_comments=False,
             save_metadata=False,
             compress_json=False,
-            post_metadata_txt_pattern=""
+            post_metadata_txt_pattern="",
+            # Pacing comes from the shared limiter instead of random sleeps
+            sleep=False,
+            rate_controller=lambda context: InstagramRateController(context)
         )
 
-        ig.context._session.cookies.update(cookies)
+        ig.context._session.cookies.update(self.cookies)
+
+        with self._lock:
+            self._instances.append(ig)
+        return ig
+
+    def get(self):
+        """The calling thread's Instaloader, an idle one or a new one on first use"""
+        ig = getattr(self._local, 'ig', None)
+        if ig is None:
+            with self._lock:
+                ig = self._idle.pop() if self._idle else None
+            ig = self._local.ig = ig or self.create()
+        return ig
+
+    def release(self):
+        """Hand the calling thread's Instaloader back for other threads to use"""
+        ig = getattr(self._local, 'ig', None)
+        if ig is not None:
+            self._local.ig = None
+            with self._lock:
+                self._idle.append(ig)
+
+    def bind(self, post):
+        """post, making its requests through the calling thread's Instaloader
+
+        Posts come from the listing thread's iterator and carry its context;
+        a copy is pointed at this thread's context (with its owner profile),
+        keeping the metadata already fetched.
+        """
+        ig = self.get()
+        if post._context is ig.context:
+            return post
+        bound = copy.copy(post)
+        bound._context = ig.context
+        if post._owner_profile is not None:
+            bound._owner_profile = copy.copy(post._owner_profile)
+            bound._owner_profile._context = ig.context
+        return bound
+
+    def close(self):
+        with self._lock:
+            instances, self._instances, self._idle = self._instances, [], []
+        for ig in instances:
+            ig.close()
+
+_default_instaloader_provider = None
+_default_instaloader_provider_lock = Lock()
+
+def get_default_instaloader_provider():
+    """Process-wide provider for callers that do not pass one, created on first use
+
+    Cookies come from COOKIE_CONFIG['browser'] and are read once; the
+    Instaloader instances are closed when the process exits.
+    """
+    global _default_instaloader_provider
+    with _default_instaloader_provider_lock:
+        if _default_instaloader_provider is None:
+            _default_instaloader_provider = InstaloaderProvider(load_browser_cookies(COOKIE_CONFIG['browser']))
+            atexit.register(_default_instaloader_provider.close)
+        return _default_instaloader_provider
+
+def load_browser_cookies(browser):
+    """Load Instagram cookies from the given browser"""
+    if browser.lower() == "chrome":
+        return browser_cookie3.chrome(domain_name="instagram.com")
+    elif browser.lower() == "safari":
+        return browser_cookie3.safari(domain_name="instagram.com")
+    else:
+        return browser_cookie3.chromium(domain_name="instagram.com")
+
+def create_scraper_session(browser="chrome"):
+    """Create the clients shared by every profile of a run (database, cookies, Instaloader, media storage)"""
+    # Only add session cleanup - everything else stays the same
+    clear_instaloader_sessions()
+
+    db = create_database_pool()
+    if not db:
+        return None
+
+    try:
+        structure_ok = db.run(ensure_database_structure)
+    except Error as e:
+        print(f"❌ Error checking database structure: {e}")
+        structure_ok = False
+
+    if not structure_ok:
+        db.close()
+        return None
+
+    try:
+        print(f"🍪 Loading cookies from {browser}...")
+        cookies = load_browser_cookies(browser)
+    except Exception as e:
+        print(f"❌ Could not load cookies from {browser}: {e}")
+        db.close()
+        return None
+
+    try:
+        storage = create_media_storage()
+    except Exception:
+        db.close()
+        return None
+
+    return {
+        'browser': browser,
+        'db': db,
+        'write_buffer': DatabaseWriteBuffer(db),
+        'instaloader': InstaloaderProvider(cookies),
+        'storage': storage,
+        'scheduler': None
+    }
+
+def close_scraper_session(session):
+    """Release the clients created by create_scraper_session"""
+    if session.get('instaloader'):
+        session['instaloader'].close()
+    if session.get('write_buffer'):
+        session['write_buffer'].close()
+    if session.get('db'):
+        session['db'].close()
+
+def download_instagram_profile(username, browser="chrome", max_posts=5, session=None):
+    """WORKING Instagram profile downloader WITH AI TRANSCRIPTION CLEANING AND TITLE GENERATION"""
+    print(f"🚀 Instagram scraper with AI cleaning and title generation for @{username}")
+    print("⚡ USING EXACT WORKING METHOD + AI TRANSCRIPTION CLEANING + PERSIAN TITLE GENERATION")
+    print("🤖 AI will clean transcriptions and generate Persian titles for website/blog use")
+    print("📅 POSTS ORDERED: Newest to Oldest")
+    print("=" * 60)
+
+    # A batch run passes in its shared session; a single run owns its own
+    owns_session = session is None
+    if owns_session:
+        session = create_scraper_session(browser)
+        if not session:
+            return None
+
+    db = session['db']
+    # Profiles of a batch run on their own threads, each with its own instance
+    ig = session['instaloader'].get()
+    journal = None
+    summary = None
 
-        download_folder = f"{username}_posts_{int(time.time())}"
+    # Stage timings, bytes and tokens of this run; pipeline threads inherit it
+    metrics = RunMetrics(username)
+    metrics_token = current_run.set(metrics)
+    # Every post's trace hangs off this profile span
+    profile_span = Span('profile', attributes={'profile.username': username})
+    span_token = current_span.set(profile_span)
+
+    try:
+        # One staging folder per profile, so an interrupted run can be resumed from it
+        download_folder = os.path.join(MEDIA_CONFIG['staging_root'], username)
         os.makedirs(download_folder, exist_ok=True)
 
         print(f"🔍 Fetching profile information...")
-        profile = instaloader.Profile.from_username(ig.context, username)
+        with timed('profile'):
+            profile = call_with_backoff(
+                lambda: instaloader.Profile.from_username(ig.context, username),
+                instagram_rate_limiter, INSTAGRAM_THROTTLE_ERRORS,
+                INSTAGRAM_RATE_CONFIG['retries'], acquire=False
+            )
 
         profile_data = {
             'full_name': profile.full_name or '',
@@ -684,77 +2168,67 @@ def download_instagram_profile(username, browser="chrome", max_posts=5):
 
         print(f"👤 {profile_data['full_name']} - {profile_data['followers']:,} followers")
 
-        agent_id = get_or_create_agent(connection, username, profile_data)
+        agent_id = get_or_create_agent(db, username, profile_data)
         if not agent_id:
-            return
+            return None
+        metrics.labels['agent_id'] = agent_id
+        profile_span.set_attribute('agent.id', agent_id)
 
-        existing_shortcodes, filtered_shortcodes = get_existing_and_filtered_shortcodes(connection, agent_id)
+        existing_shortcodes, filtered_shortcodes = get_existing_and_filtered_shortcodes(db, agent_id)
 
         print(f"📊 Already have {len(existing_shortcodes)} posts in database")
         print(f"📊 Already filtered {len(filtered_shortcodes)} posts")
 
-        profile_pic_response = requests.get(profile.get_profile_pic_url(), timeout=15)
-        if profile_pic_response.status_code == 200:
-            with open(os.path.join(download_folder, f"{username}_profile.jpg"), 'wb') as f:
-                f.write(profile_pic_response.content)
+        journal = CheckpointJournal(os.path.join(download_folder, "checkpoints.jsonl"))
+        journal.open(existing_shortcodes | filtered_shortcodes)
+        resumed_jobs = journal.resumable_jobs(download_folder)
+        if resumed_jobs:
+            print(f"♻️  Resuming {len(resumed_jobs)} posts left unfinished by an interrupted run")
+
+        sync = ProfileSync(profile, get_sync_state(db, agent_id))
+        if sync.mark:
+            print(f"🔖 Incremental sync: new posts after {sync.mark:%Y-%m-%d %H:%M}"
+                  f"{', backfill complete' if sync.state['backfill_complete'] else ''}")
+
+        storage = session['storage']
+        profile_pic_path = os.path.join(download_folder, f"{username}_profile.jpg")
+        if download_media_file(profile.get_profile_pic_url(), profile_pic_path):
+            profile_image = storage.publish(profile_pic_path, profile_media_key(agent_id))
+            if profile_image != f"/agents/{agent_id}/profile/profile_picture.jpg":
+                update_agent_profile_image(db, agent_id, profile_image)
 
         print(f"📥 Getting posts from Instagram (this may take a moment)...")
 
-        saved_posts_info = []
-        successful_posts = 0
-        skipped_posts = 0
-        filtered_posts = 0
-        total_checked = 0
-        current_post_number = get_next_post_number(connection, agent_id)
+        # Numbers of posts published before an interruption stay reserved
+        current_post_number = max(get_next_post_number(db, agent_id), journal.max_post_number() + 1)
 
         print(f"🎯 Looking for {max_posts} NEW posts...")
         print(f"📋 Starting from post number {current_post_number}")
+        print(f"⚙️  Pipeline workers: {', '.join(f'{name}={count}' for name, count in PIPELINE_CONFIG['workers'].items())}")
 
-        for post in profile.get_posts():
-            if successful_posts >= max_posts:
-                print(f"✅ SUCCESS: Got {max_posts} new posts, stopping!")
-                break
-
-            total_checked += 1
-            post_shortcode = post.shortcode
-            post_date = post.date_utc.strftime('%Y-%m-%d %H:%M')
-
-            if post_shortcode in existing_shortcodes:
-                skipped_posts += 1
-                print(f"⏭️  Skip #{total_checked} (exists): {post_date}")
-                continue
-
-            if post_shortcode in filtered_shortcodes:
-                filtered_posts += 1
-                print(f"🚫 Skip #{total_checked} (filtered): {post_date}")
-                continue
-
-            print(f"🆕 NEW POST #{total_checked} ({successful_posts + 1}/{max_posts}): {post_date}")
-
-            result, status = process_single_post(
-                post, agent_id, connection, download_folder, current_post_number,
-                existing_shortcodes, filtered_shortcodes, profile_data, username
-            )
-
-            if status == "success" and result:
-                saved_posts_info.append(result)
-                existing_shortcodes.add(result['shortcode'])
-                successful_posts += 1
-                current_post_number += 1
-                print(f"✅ SAVED: Post {successful_posts}/{max_posts} (AI cleaned + Persian title)")
-            elif status == "filtered":
-                filtered_shortcodes.add(post_shortcode)
-                filtered_posts += 1
-                print(f"🚫 FILTERED: Not suitable")
-            else:
-                print(f"❌ FAILED: Could not process")
-
-            # Add small random delay to avoid rate limiting
-            time.sleep(random.uniform(0.5, 1.5))
-
-        if successful_posts > 0:
-            print(f"📁 Organizing {successful_posts} files...")
-            organize_files_optimized(username, agent_id, download_folder, saved_posts_info)
+        context = create_pipeline_context(
+            agent_id, db, download_folder, existing_shortcodes,
+            filtered_shortcodes, profile_data, username, current_post_number,
+            session['write_buffer'], session['instaloader'], storage, journal
+        )
+        try:
+            summary = PostPipeline(context, max_posts, scheduler=session['scheduler']).run(sync.posts(), resumed_jobs)
+        finally:
+            # Everything queued for this profile reaches the database before we report on it
+            session['write_buffer'].flush()
+
+        # Rows first, cursor second: a crash in between only re-checks posts
+        flushed = session['write_buffer'].flush()
+        rejected = session['write_buffer'].take_rejected(agent_id)
+        if rejected:
+            discount_rejected_posts(summary, rejected, existing_shortcodes, filtered_shortcodes)
+        if flushed:
+            sync.commit(db, agent_id, summary['failed_shortcodes'])
+
+        successful_posts = summary['successful_posts']
+        skipped_posts = summary['skipped_posts']
+        filtered_posts = summary['filtered_posts']
+        total_checked = summary['total_checked']
 
         print(f"\n🎉 FINAL SUMMARY")
         print("=" * 50)
@@ -766,6 +2240,7 @@ def download_instagram_profile(username, browser="chrome", max_posts=5):
         print(f"🤖 AI cleaned transcriptions: {successful_posts}")
         print(f"🏷️ AI generated Persian titles: {successful_posts}")
         print(f"📊 Database now has: {len(existing_shortcodes)} total posts")
+        print(f"📁 Files published to: {storage.public_url(f'agents/{agent_id}')}")
         print(f"🔄 CONTINUATION: ✅ WORKING")
         print(f"📅 Order: Newest to Oldest ✅")
 
@@ -773,10 +2248,19 @@ def download_instagram_profile(username, browser="chrome", max_posts=5):
             print(f"⚠️  Note: Only found {successful_posts} new posts (requested {max_posts})")
             print("   This means you've reached older posts or end of profile")
 
-        try:
-            shutil.rmtree(download_folder)
-        except:
-            pass
+        # Keep the staging folder while checkpointed posts still wait for a later run
+        unfinished = journal.resumable_jobs(download_folder, existing_shortcodes | filtered_shortcodes)
+        if flushed and not unfinished:
+            journal.close()
+            try:
+                shutil.rmtree(download_folder)
+            except:
+                pass
+        else:
+            prune_staging_folder(download_folder, unfinished)
+            print(f"♻️  Kept {download_folder} to resume {len(unfinished)} unfinished posts next run")
+
+        return summary
 
     except QueryReturnedBadRequestException as e:
         print(f"⚠️ Rate limited or unauthorized: {e}")
@@ -788,8 +2272,85 @@ def download_instagram_profile(username, browser="chrome", max_posts=5):
     except Exception as e:
         print(f"❌ Unexpected error: {e}")
     finally:
-        if connection and connection.is_connected():
-            connection.close()
+        if journal:
+            journal.close()
+        # The next profile of a batch reuses this thread's Instaloader
+        session['instaloader'].release()
+        if owns_session:
+            close_scraper_session(session)
+
+        current_span.reset(span_token)
+        if not summary:
+            profile_span.set_error("profile run failed")
+        profile_span.end()
+        flush_spans()
+
+        current_run.reset(metrics_token)
+        metrics.finish("completed" if summary else "failed")
+        if summary:
+            metrics.labels.update({name: summary[name] for name in
+                                   ('successful_posts', 'skipped_posts', 'filtered_posts', 'failed_posts')})
+        if METRICS_CONFIG['enabled']:
+            metrics.print_summary()
+            report_path = metrics.write_report()
+            if report_path:
+                print(f"📈 Run report: {report_path}")
+
+def read_usernames_file(path):
+    """Read one username per line; blank lines and # comments are ignored"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return [line.strip().lstrip('@') for line in f
+                if line.strip() and not line.strip().startswith('#')]
+
+def download_instagram_profiles(usernames, browser="chrome", max_posts=5, max_profiles=None, max_posts_in_flight=None):
+    """Batch mode: scrape many profiles under one scheduler with shared clients"""
+    usernames = list(dict.fromkeys(username.strip().lstrip('@') for username in usernames if username.strip()))
+    if not usernames:
+        print("⚠️ No usernames given")
+        return {}
+
+    max_profiles = max_profiles or BATCH_CONFIG['max_profiles']
+    max_posts_in_flight = max_posts_in_flight or BATCH_CONFIG['max_posts_in_flight']
+
+    print(f"📦 Batch run for {len(usernames)} profiles")
+    print(f"⚙️  {max_profiles} profiles at a time, {max_posts_in_flight} posts in flight overall")
+    print("=" * 60)
+
+    started = time.time()
+
+    # Startup cost (cookies, Instaloader, database) is paid once for the whole batch
+    session = create_scraper_session(browser)
+    if not session:
+        return {}
+    session['scheduler'] = PostSlotScheduler(max_posts_in_flight)
+
+    results = {}
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_profiles) as executor:
+            futures = {
+                executor.submit(download_instagram_profile, username, browser, max_posts, session): username
+                for username in usernames
+            }
+            for future in concurrent.futures.as_completed(futures):
+                username = futures[future]
+                try:
+                    results[username] = future.result()
+                except Exception as e:
+                    print(f"❌ Profile @{username} failed: {e}")
+                    results[username] = None
+    finally:
+        close_scraper_session(session)
+
+    print(f"\n📦 BATCH SUMMARY ({time.time() - started:.0f}s)")
+    print("=" * 50)
+    for username in usernames:
+        summary = results.get(username)
+        if summary:
+            print(f"✅ @{username}: {summary['successful_posts']} saved, {summary['filtered_posts']} filtered, {summary['skipped_posts']} skipped")
+        else:
+            print(f"❌ @{username}: failed")
+
+    return results
 
 def test_database_and_show_agents():
     """Test database connection - OPTIMIZED"""
@@ -811,7 +2372,51 @@ def test_database_and_show_agents():
             cursor.close()
             connection.close()
 
+def parse_arguments():
+    """Command line options for batch mode; no usernames means interactive mode"""
+    parser = argparse.ArgumentParser(description="Instagram scraper with AI transcription cleaning and Persian titles")
+    parser.add_argument('usernames', nargs='*', help="Instagram usernames to scrape")
+    parser.add_argument('--file', help="File with one username per line")
+    parser.add_argument('--browser', default=COOKIE_CONFIG['browser'], help=f"Browser to load cookies from (default: {COOKIE_CONFIG['browser']})")
+    parser.add_argument('--max-posts', type=int, default=5, help="Max NEW posts per profile (default: 5)")
+    parser.add_argument('--max-profiles', type=int, default=BATCH_CONFIG['max_profiles'],
+                        help="Profiles scraped at the same time")
+    parser.add_argument('--max-posts-in-flight', type=int, default=BATCH_CONFIG['max_posts_in_flight'],
+                        help="Posts processed at the same time across all profiles")
+    parser.add_argument('--no-llm-cache', action='store_true',
+                        help="Ignore cached AI responses (fresh responses are still cached)")
+    parser.add_argument('--metrics-port', type=int, default=METRICS_CONFIG['port'],
+                        help="Serve Prometheus metrics on this port (default: SCRAPER_METRICS_PORT, off)")
+    parser.add_argument('--trace-file', default=TRACING_CONFIG['path'] or None,
+                        help="Write per-post trace spans (OTLP JSON) to this file (default: SCRAPER_TRACE_FILE, off)")
+    parser.add_argument('--full-sync', action='store_true',
+                        help="Scan every post instead of stopping at the last synced post")
+    return parser.parse_args()
+
 if __name__ == "__main__":
+    args = parse_arguments()
+    if args.no_llm_cache:
+        content_cache.CACHE_CONFIG['bypass'] = True
+    if args.full_sync:
+        SYNC_CONFIG['incremental'] = False
+    if args.metrics_port:
+        start_metrics_server(args.metrics_port)
+    if args.trace_file:
+        TRACING_CONFIG['path'] = args.trace_file
+
+    batch_usernames = list(args.usernames)
+    if args.file:
+        batch_usernames += read_usernames_file(args.file)
+
+    if batch_usernames:
+        test_database_and_show_agents()
+        download_instagram_profiles(
+            batch_usernames, args.browser, args.max_posts,
+            args.max_profiles, args.max_posts_in_flight
+        )
+        print("\n🎉 Batch scraping completed!")
+        sys.exit(0)
+
     print("🚀 INSTAGRAM SCRAPER WITH AI TRANSCRIPTION CLEANING AND PERSIAN TITLE GENERATION")
     print("=" * 60)
     print("✅ USING EXACT WORKING METHOD FROM YOUR ORIGINAL CODE")
@@ -825,12 +2430,13 @@ if __name__ == "__main__":
     print("• And so on...")
     print("🧹 FEATURES:")
     print("• Session cleanup (clears old cookies)")
-    print("• Random delays (avoids rate limits)")
+    print("• Adaptive rate limiting with backoff on 429s (shared across threads)")
     print("• AI transcription cleaning for website/blog")
     print("• AI Persian title generation (unique, content-based)")
     print("• Saves both original and cleaned transcriptions")
     print("📅 POST ORDERING: Newest to Oldest")
     print("🔍 FILTER: 50+ Persian characters only")
+    print("⚡ PRE-FILTER: image posts and too-short videos skipped before download")
     print("🏷️ TITLE GENERATION: AI creates unique titles based on actual content")
     print("=" * 60)
 
@@ -845,7 +2451,7 @@ if __name__ == "__main__":
     print("=" * 60)
 
     username = input("Enter Instagram username (default: mojtaba.dubai.amlak): ").strip() or "mojtaba.dubai.amlak"
-    browser = input("Enter browser (chrome/firefox, default: chrome): ").strip() or "chrome"
+    browser = input(f"Enter browser (chrome/firefox, default: {COOKIE_CONFIG['browser']}): ").strip() or COOKIE_CONFIG['browser']
     try:
         max_posts = int(input("Enter max NEW posts to get (default: 5): ").strip() or "5")
     except ValueError:
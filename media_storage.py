@@ -0,0 +1,174 @@
+import concurrent.futures
+import mimetypes
+import os
+import shutil
+import uuid
+
+# Media storage configuration
+MEDIA_STORAGE_CONFIG = {
+    'backend': os.getenv('MEDIA_STORAGE', 'local'),  # local | s3 | objectstore
+    'public_root': os.getenv('MEDIA_PUBLIC_ROOT', 'public'),
+    'public_url': os.getenv('MEDIA_PUBLIC_URL', ''),
+    's3_bucket': os.getenv('MEDIA_S3_BUCKET', ''),
+    's3_endpoint_url': os.getenv('MEDIA_S3_ENDPOINT_URL') or None,
+    's3_region': os.getenv('MEDIA_S3_REGION') or None,
+    'object_store_root': os.getenv('MEDIA_OBJECT_STORE_ROOT', '.object_store'),
+    'object_store_bucket': os.getenv('MEDIA_OBJECT_STORE_BUCKET', 'agents-media'),
+    'object_store_url': os.getenv('MEDIA_OBJECT_STORE_URL', 'http://localhost:9000'),
+    'multipart_threshold': int(os.getenv('MEDIA_MULTIPART_THRESHOLD_MB', '8')) * 1024 * 1024,
+    'multipart_chunk_size': int(os.getenv('MEDIA_MULTIPART_CHUNK_MB', '8')) * 1024 * 1024,
+    'max_concurrency': int(os.getenv('MEDIA_UPLOAD_CONCURRENCY', '4'))
+}
+
+def post_media_key(agent_id, file_name):
+    return f"agents/{agent_id}/posts/{file_name}"
+
+def profile_media_key(agent_id, file_name="profile_picture.jpg"):
+    return f"agents/{agent_id}/profile/{file_name}"
+
+def _content_type(path):
+    return mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+class LocalStorage:
+    """Next.js public/ folder; files are renamed into place and served from /{key}"""
+
+    def __init__(self, public_root=None, public_url=None):
+        self.public_root = public_root or MEDIA_STORAGE_CONFIG['public_root']
+        self.url_prefix = (MEDIA_STORAGE_CONFIG['public_url'] if public_url is None else public_url).rstrip('/')
+
+    def public_url(self, key):
+        return f"{self.url_prefix}/{key}"
+
+    def publish(self, source, key):
+        """Move a finished local file to key and return its public URL"""
+        destination = os.path.join(self.public_root, *key.split('/'))
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        try:
+            os.replace(source, destination)
+        except OSError:
+            # Staging is on another filesystem, fall back to copy + delete
+            shutil.move(source, destination)
+        return self.public_url(key)
+
+class S3Storage:
+    """S3-compatible bucket (AWS S3, MinIO, R2) through boto3.
+
+    Files above the multipart threshold are uploaded in parts on several
+    threads. Requires boto3, which is only imported when this backend is used.
+    """
+
+    def __init__(self, bucket=None, endpoint_url=None, region=None, public_url=None):
+        import boto3
+        from boto3.s3.transfer import TransferConfig
+
+        self.bucket = bucket or MEDIA_STORAGE_CONFIG['s3_bucket']
+        if not self.bucket:
+            raise ValueError("MEDIA_S3_BUCKET is not set")
+
+        endpoint_url = endpoint_url or MEDIA_STORAGE_CONFIG['s3_endpoint_url']
+        self._client = boto3.client(
+            's3',
+            endpoint_url=endpoint_url,
+            region_name=region or MEDIA_STORAGE_CONFIG['s3_region']
+        )
+        self._transfer_config = TransferConfig(
+            multipart_threshold=MEDIA_STORAGE_CONFIG['multipart_threshold'],
+            multipart_chunksize=MEDIA_STORAGE_CONFIG['multipart_chunk_size'],
+            max_concurrency=MEDIA_STORAGE_CONFIG['max_concurrency'],
+            use_threads=True
+        )
+
+        public_url = public_url or MEDIA_STORAGE_CONFIG['public_url']
+        if not public_url:
+            public_url = f"{endpoint_url.rstrip('/')}/{self.bucket}" if endpoint_url else f"https://{self.bucket}.s3.amazonaws.com"
+        self.url_prefix = public_url.rstrip('/')
+
+    def public_url(self, key):
+        return f"{self.url_prefix}/{key}"
+
+    def publish(self, source, key):
+        """Upload a finished local file to key, remove the local copy and return its public URL"""
+        self._client.upload_file(
+            source, self.bucket, key,
+            ExtraArgs={'ContentType': _content_type(source)},
+            Config=self._transfer_config
+        )
+        os.remove(source)
+        return self.public_url(key)
+
+class LocalObjectStore:
+    """MinIO-style stand-in on local disk, for tests and offline runs.
+
+    Objects live in root/bucket/key and are addressed by base_url/bucket/key.
+    Large files follow the same flow as an S3 multipart upload: parts are
+    uploaded concurrently and the object only appears, atomically, once the
+    upload is completed.
+    """
+
+    def __init__(self, root=None, bucket=None, base_url=None, part_size=None, max_concurrency=None):
+        self.root = root or MEDIA_STORAGE_CONFIG['object_store_root']
+        self.bucket = bucket or MEDIA_STORAGE_CONFIG['object_store_bucket']
+        self.url_prefix = f"{(base_url or MEDIA_STORAGE_CONFIG['object_store_url']).rstrip('/')}/{self.bucket}"
+        self.part_size = part_size or MEDIA_STORAGE_CONFIG['multipart_chunk_size']
+        self.max_concurrency = max_concurrency or MEDIA_STORAGE_CONFIG['max_concurrency']
+
+    def public_url(self, key):
+        return f"{self.url_prefix}/{key}"
+
+    def object_path(self, key):
+        return os.path.join(self.root, self.bucket, *key.split('/'))
+
+    def _upload_part(self, source, upload_dir, part_number, offset, length):
+        with open(source, 'rb') as src, open(os.path.join(upload_dir, f"part_{part_number:05d}"), 'wb') as dst:
+            src.seek(offset)
+            dst.write(src.read(length))
+
+    def publish(self, source, key):
+        """Multipart-upload a finished local file to key and return its public URL"""
+        size = os.path.getsize(source)
+        destination = self.object_path(key)
+        upload_dir = os.path.join(self.root, '.uploads', uuid.uuid4().hex)
+        os.makedirs(upload_dir, exist_ok=True)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+
+        try:
+            parts = [(number, offset, min(self.part_size, size - offset))
+                     for number, offset in enumerate(range(0, max(size, 1), self.part_size), start=1)]
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+                list(executor.map(lambda part: self._upload_part(source, upload_dir, *part), parts))
+
+            # Complete the upload: assemble the parts and make the object visible in one rename
+            assembled = os.path.join(upload_dir, "object")
+            with open(assembled, 'wb') as dst:
+                for number, _, _ in parts:
+                    with open(os.path.join(upload_dir, f"part_{number:05d}"), 'rb') as part:
+                        shutil.copyfileobj(part, dst)
+            os.replace(assembled, destination)
+        finally:
+            shutil.rmtree(upload_dir, ignore_errors=True)
+
+        os.remove(source)
+        return self.public_url(key)
+
+def create_media_storage(backend=None):
+    """Storage backend selected by MEDIA_STORAGE
+
+    A backend that cannot be set up raises instead of falling back to the
+    local public/ folder, where the files would never reach the site.
+    """
+    backend = (backend or MEDIA_STORAGE_CONFIG['backend']).lower()
+    try:
+        if backend == 's3':
+            storage = S3Storage()
+        elif backend == 'objectstore':
+            storage = LocalObjectStore()
+        elif backend == 'local':
+            storage = LocalStorage()
+        else:
+            raise ValueError("unknown MEDIA_STORAGE backend (use local, s3 or objectstore)")
+    except Exception as e:
+        print(f"❌ Error initializing {backend} media storage, refusing to start: {e}")
+        raise
+
+    print(f"🗄️  Media storage: {type(storage).__name__}")
+    return storage
@@ -0,0 +1,373 @@
+import asyncio
+import os
+import random
+import time
+import weakref
+from threading import BoundedSemaphore, Lock
+
+from scraper_metrics import add_counter, observe
+from scraper_tracing import span
+
+def _optional_int(name, default=''):
+    value = os.getenv(name, default)
+    return int(value) if value else None
+
+# Request budgets per AI provider. RPM/TPM left empty are not limited;
+# in_flight caps concurrent requests. Defaults follow the free/starter tiers.
+PROVIDER_LIMITS = {
+    'elevenlabs': {
+        'rpm': _optional_int('ELEVENLABS_RPM', '60'),
+        'tpm': None,
+        'in_flight': int(os.getenv('ELEVENLABS_MAX_IN_FLIGHT', '3'))
+    },
+    'groq': {
+        'rpm': _optional_int('GROQ_RPM', '30'),
+        'tpm': _optional_int('GROQ_TPM', '15000'),
+        'in_flight': int(os.getenv('GROQ_MAX_IN_FLIGHT', '4'))
+    },
+    'openrouter': {
+        'rpm': _optional_int('OPENROUTER_RPM', '60'),
+        'tpm': _optional_int('OPENROUTER_TPM'),
+        'in_flight': int(os.getenv('OPENROUTER_MAX_IN_FLIGHT', '4'))
+    }
+}
+
+# Retry and circuit breaker settings shared by every provider
+GATEWAY_CONFIG = {
+    'retries': int(os.getenv('PROVIDER_RETRIES', '5')),
+    'backoff': float(os.getenv('PROVIDER_BACKOFF_SECONDS', '1.0')),
+    'max_backoff': float(os.getenv('PROVIDER_MAX_BACKOFF_SECONDS', '30')),
+    'failure_threshold': int(os.getenv('PROVIDER_CIRCUIT_FAILURES', '5')),
+    'reset_timeout': float(os.getenv('PROVIDER_CIRCUIT_RESET_SECONDS', '60'))
+}
+
+class TokenBucket:
+    """Thread-safe token bucket: rate tokens per second, up to capacity saved up for bursts"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def set_rate(self, rate):
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = rate
+
+    def reserve(self, tokens=1):
+        """Take tokens now, going into debt if needed; returns the seconds to wait before using them"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= min(tokens, self.capacity)
+            return max(0.0, -self._tokens / self.rate)
+
+    def acquire(self, tokens=1):
+        """Block until tokens are available and take them"""
+        wait = self.reserve(tokens)
+        if wait:
+            time.sleep(wait)
+
+class AdaptiveRateLimiter:
+    """Token bucket whose rate follows server feedback (AIMD).
+
+    A throttling response halves the rate and pauses every caller for a
+    cooldown that doubles on consecutive throttles. Throttles reported while
+    already paused belong to the same burst and are ignored. Once the pause
+    is over the rate grows back linearly, by recovery tokens/s every second,
+    up to max_rate.
+    """
+
+    def __init__(self, name, rate, burst, max_rate=None, min_rate=None, recovery=None, cooldown=30, max_cooldown=900):
+        self.name = name
+        self.max_rate = max_rate or rate
+        self.min_rate = min_rate or rate / 20
+        self.recovery = recovery if recovery is not None else self.max_rate / 300
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+
+        self._bucket = TokenBucket(rate, burst)
+        self._lock = Lock()
+        self._paused_until = 0.0
+        self._last_change = time.monotonic()
+        self._throttles = 0
+
+    @property
+    def rate(self):
+        return self._bucket.rate
+
+    def _recover(self, now):
+        if self.rate < self.max_rate and now > self._last_change:
+            self._bucket.set_rate(min(self.max_rate, self.rate + self.recovery * (now - self._last_change)))
+            self._last_change = now
+            if self.rate >= self.max_rate:
+                self._throttles = 0
+
+    def reserve(self, tokens=1):
+        """Book a request; returns the seconds to wait before sending it"""
+        with self._lock:
+            now = time.monotonic()
+            pause = max(0.0, self._paused_until - now)
+            if not pause:
+                self._recover(now)
+        return pause + self._bucket.reserve(tokens)
+
+    def acquire(self, tokens=1):
+        """Block until the limiter allows another request"""
+        wait = self.reserve(tokens)
+        if wait:
+            time.sleep(wait)
+
+    def on_throttle(self, retry_after=None):
+        """Report a throttling response; returns the seconds callers are paused for"""
+        with self._lock:
+            now = time.monotonic()
+            if now < self._paused_until:
+                return self._paused_until - now
+
+            self._throttles += 1
+            self._bucket.set_rate(max(self.min_rate, self.rate / 2))
+            pause = min(self.max_cooldown, self.cooldown * 2 ** (self._throttles - 1))
+            if retry_after:
+                pause = max(pause, retry_after)
+            pause *= random.uniform(1.0, 1.2)
+
+            self._paused_until = now + pause
+            self._last_change = self._paused_until
+            print(f"⏳ {self.name} throttled: pausing {pause:.0f}s, then {self.rate:.2f} requests/s")
+            return pause
+
+def call_with_backoff(func, limiter, retry_on, retries=4, acquire=True):
+    """Call func() under limiter; throttling errors (retry_on) slow the limiter down and retry
+
+    Pass acquire=False when func already waits on the limiter itself.
+    """
+    for attempt in range(1, retries + 1):
+        if acquire:
+            limiter.acquire()
+        try:
+            return func()
+        except retry_on as e:
+            if attempt == retries:
+                raise
+            pause = limiter.on_throttle()
+            print(f"⚠️ {limiter.name}: {type(e).__name__}, retrying in {pause:.0f}s ({attempt}/{retries - 1})...")
+            if not acquire:
+                limiter.acquire(0)
+
+def iterate_with_backoff(iterator, limiter, retry_on, retries=4):
+    """Yield from iterator, retrying a next() that failed with a throttling error"""
+    end = object()
+    while True:
+        item = call_with_backoff(lambda: next(iterator, end), limiter, retry_on, retries, acquire=False)
+        if item is end:
+            return
+        yield item
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a provider that keeps failing"""
+
+def _status_code(error):
+    status = getattr(error, 'status_code', None)
+    if status is None:
+        status = getattr(getattr(error, 'response', None), 'status_code', None)
+    return status if isinstance(status, int) else None
+
+def _retry_after(error):
+    headers = getattr(getattr(error, 'response', None), 'headers', None) or getattr(error, 'headers', None) or {}
+    try:
+        return float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+def is_retryable_error(error):
+    """Rate limits, server errors, timeouts and dropped connections are worth retrying"""
+    status = _status_code(error)
+    if status is not None:
+        return status in (408, 409, 429) or status >= 500
+    name = type(error).__name__
+    return 'Timeout' in name or 'Connection' in name
+
+def is_provider_unavailable(error):
+    """True when a gateway call failed because the provider is down, over quota or refuses our key
+
+    That is an open circuit, a retryable error still there after the
+    gateway's retries, or an authentication error, as opposed to the provider
+    rejecting this particular request. Callers should fail the work and retry
+    it later instead of recording a permanent result.
+    """
+    return isinstance(error, CircuitOpenError) or _status_code(error) in (401, 403) or is_retryable_error(error)
+
+def estimate_chat_tokens(request):
+    """Rough token cost of a chat request (prompt at ~3 characters per token plus the completion budget)"""
+    prompt_chars = sum(len(str(message.get('content', ''))) for message in request.get('messages', []))
+    return prompt_chars // 3 + (request.get('max_tokens') or 1024)
+
+class ProviderGateway:
+    """Front door for one AI provider's API.
+
+    Every call waits for the provider's request (RPM) and token (TPM) budgets
+    and for a free in-flight slot, so any number of worker threads can share
+    the quota. Rate limits, server errors and timeouts are retried with
+    jittered exponential backoff; a 429 also slows the request budget down
+    for all callers. After failure_threshold consecutive failures (429s not
+    counted) the circuit opens: calls fail fast with CircuitOpenError until
+    reset_timeout has passed and a trial call succeeds.
+    """
+
+    def __init__(self, name, rpm=None, tpm=None, in_flight=4, retries=None, backoff=None,
+                 max_backoff=None, failure_threshold=None, reset_timeout=None):
+        self.name = name
+        self.retries = retries or GATEWAY_CONFIG['retries']
+        self.backoff = backoff or GATEWAY_CONFIG['backoff']
+        self.max_backoff = max_backoff or GATEWAY_CONFIG['max_backoff']
+        self.failure_threshold = failure_threshold or GATEWAY_CONFIG['failure_threshold']
+        self.reset_timeout = reset_timeout or GATEWAY_CONFIG['reset_timeout']
+
+        self._requests = AdaptiveRateLimiter(name, rpm / 60, max(1, rpm // 10), cooldown=10) if rpm else None
+        self._tokens = TokenBucket(tpm / 60, tpm) if tpm else None
+        self.in_flight = in_flight
+        self._slots = BoundedSemaphore(in_flight)
+        # acall() slots, one asyncio.Semaphore per event loop using the gateway
+        self._async_slots = weakref.WeakKeyDictionary()
+
+        self._lock = Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+
+    def _enter_circuit(self):
+        with self._lock:
+            if self._opened_at is None:
+                return
+            remaining = self.reset_timeout - (time.monotonic() - self._opened_at)
+            if remaining > 0 or self._trial_running:
+                raise CircuitOpenError(f"{self.name} circuit open, retry in {max(remaining, 0):.0f}s")
+            # Half-open: let one trial call through
+            self._trial_running = True
+
+    def _record(self, success):
+        with self._lock:
+            self._trial_running = False
+            if success:
+                if self._opened_at is not None:
+                    print(f"✅ {self.name} recovered, circuit closed")
+                self._failures = 0
+                self._opened_at = None
+                return
+
+            self._failures += 1
+            if self._failures >= self.failure_threshold or self._opened_at is not None:
+                self._opened_at = time.monotonic()
+                print(f"🔌 {self.name} circuit open after {self._failures} failures, pausing calls for {self.reset_timeout:.0f}s")
+
+    def _loop_slots(self):
+        """The running event loop's in-flight semaphore, created on first use"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            slots = self._async_slots.get(loop)
+            if slots is None:
+                slots = self._async_slots[loop] = asyncio.Semaphore(self.in_flight)
+            return slots
+
+    def _reserve_budget(self, tokens):
+        """Book one request and its tokens; returns the seconds to wait before sending"""
+        wait = self._requests.reserve() if self._requests else 0.0
+        if self._tokens and tokens:
+            wait = max(wait, self._tokens.reserve(tokens))
+        return wait
+
+    def _failed_attempt(self, error, attempt):
+        """Book a failed attempt: re-raises when it should not be retried, else returns the backoff delay"""
+        if not is_retryable_error(error):
+            self._record(True)  # The provider answered; the request itself was bad
+            raise error
+
+        throttled = _status_code(error) == 429
+        if throttled:
+            with self._lock:
+                self._trial_running = False
+        else:
+            self._record(False)
+
+        if attempt == self.retries or self._opened_at is not None:
+            raise error
+
+        if throttled and self._requests:
+            # The request budget pauses every caller, nothing more to wait for here
+            pause = self._requests.on_throttle(_retry_after(error))
+            print(f"⚠️ {self.name}: {type(error).__name__}, retry {attempt}/{self.retries - 1} in {pause:.1f}s")
+            return 0.0
+
+        delay = min(self.max_backoff, self.backoff * 2 ** (attempt - 1)) * random.uniform(0.5, 1.5)
+        print(f"⚠️ {self.name}: {type(error).__name__}, retry {attempt}/{self.retries - 1} in {delay:.1f}s")
+        return delay
+
+    def call(self, func, tokens=0):
+        """Run func() within the provider's limits, retrying transient failures"""
+        for attempt in range(1, self.retries + 1):
+            self._enter_circuit()
+            wait = self._reserve_budget(tokens)
+            if wait:
+                time.sleep(wait)
+
+            started = time.perf_counter()
+            try:
+                with self._slots, span(f"{self.name} request", provider=self.name, attempt=attempt):
+                    result = func()
+            except Exception as e:
+                add_counter('api_errors', provider=self.name)
+                delay = self._failed_attempt(e, attempt)
+                if delay:
+                    time.sleep(delay)
+                continue
+
+            observe(f"api_{self.name}", time.perf_counter() - started)
+            add_counter('api_requests', provider=self.name)
+            self._record(True)
+            return result
+
+    async def acall(self, func, tokens=0):
+        """Async call(): awaits func(), a coroutine function, without blocking the event loop.
+
+        Budgets and the circuit are shared with call(). The in-flight cap is
+        enforced per event loop with an asyncio.Semaphore, separately from the
+        thread slots of call().
+        """
+        for attempt in range(1, self.retries + 1):
+            self._enter_circuit()
+            wait = self._reserve_budget(tokens)
+            if wait:
+                await asyncio.sleep(wait)
+
+            started = time.perf_counter()
+            try:
+                async with self._loop_slots():
+                    with span(f"{self.name} request", provider=self.name, attempt=attempt):
+                        result = await func()
+            except Exception as e:
+                add_counter('api_errors', provider=self.name)
+                delay = self._failed_attempt(e, attempt)
+                if delay:
+                    await asyncio.sleep(delay)
+                continue
+
+            observe(f"api_{self.name}", time.perf_counter() - started)
+            add_counter('api_requests', provider=self.name)
+            self._record(True)
+            return result
+
+_gateways = {}
+_gateways_lock = Lock()
+
+def get_gateway(provider):
+    """Process-wide gateway for a provider listed in PROVIDER_LIMITS"""
+    with _gateways_lock:
+        if provider not in _gateways:
+            _gateways[provider] = ProviderGateway(provider, **PROVIDER_LIMITS[provider])
+        return _gateways[provider]
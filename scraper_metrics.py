@@ -0,0 +1,294 @@
+import contextlib
+import contextvars
+import json
+import math
+import os
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+
+# Run reports: one JSON file per profile run. Setting a port also serves live
+# process-wide metrics in the Prometheus text format at /metrics.
+METRICS_CONFIG = {
+    'enabled': os.getenv('SCRAPER_METRICS', 'true').lower() not in ('0', 'false', 'no'),
+    'report_dir': os.getenv('SCRAPER_METRICS_DIR', '.scraper_metrics'),
+    'port': int(os.getenv('SCRAPER_METRICS_PORT') or 0),
+    'host': os.getenv('SCRAPER_METRICS_HOST', '127.0.0.1')
+}
+
+# The run being measured. Pipeline worker threads start in a copy of the
+# profile thread's context, and coroutines submitted to the enrichment loop
+# with run_coroutine_threadsafe inherit the submitting thread's context, so
+# every stage, API call and download lands in the right run.
+current_run = contextvars.ContextVar('current_run', default=None)
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of values (fraction between 0 and 1), None when empty"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+class RunMetrics:
+    """Stage latencies and counters of one scraper run.
+
+    Timings are kept per stage (listing, download, transcribe, clean, title,
+    persist, publish, db_write, API calls, ...) and per post; counters sum
+    bytes, tokens and requests. Safe to share between threads.
+    """
+
+    def __init__(self, name, **labels):
+        self.name = name
+        self.labels = labels
+        self.started_at = datetime.now(timezone.utc)
+        self.finished_at = None
+        self.status = None
+        self._started = time.perf_counter()
+        self._duration = None
+        self._lock = Lock()
+
+        self.timings = {}
+        self.counters = {}
+        self.posts = {}
+
+    def observe(self, stage, seconds, shortcode=None):
+        """Record one stage duration, optionally for a post"""
+        with self._lock:
+            self.timings.setdefault(stage, []).append(seconds)
+            if shortcode:
+                post = self.posts.setdefault(shortcode, {})
+                post[stage] = post.get(stage, 0.0) + seconds
+
+    def add(self, counter, amount=1, **labels):
+        if labels:
+            counter = f"{counter}{{{','.join(f'{name}={value}' for name, value in sorted(labels.items()))}}}"
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    @contextlib.contextmanager
+    def timer(self, stage, shortcode=None):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started, shortcode)
+
+    @property
+    def duration(self):
+        return self._duration if self._duration is not None else time.perf_counter() - self._started
+
+    def finish(self, status="completed"):
+        self.status = status
+        self.finished_at = datetime.now(timezone.utc)
+        self._duration = time.perf_counter() - self._started
+
+    def stage_summary(self):
+        """count, total, mean, p50, p95 and max seconds of every stage"""
+        with self._lock:
+            timings = {stage: list(values) for stage, values in self.timings.items()}
+        return {
+            stage: {
+                'count': len(values),
+                'total': round(sum(values), 3),
+                'mean': round(sum(values) / len(values), 3),
+                'p50': round(percentile(values, 0.5), 3),
+                'p95': round(percentile(values, 0.95), 3),
+                'max': round(max(values), 3)
+            }
+            for stage, values in timings.items()
+        }
+
+    def report(self):
+        """Machine-readable run report"""
+        with self._lock:
+            counters = dict(self.counters)
+            posts = {shortcode: {stage: round(seconds, 3) for stage, seconds in stages.items()}
+                     for shortcode, stages in self.posts.items()}
+        return {
+            'run': self.name,
+            'labels': self.labels,
+            'status': self.status,
+            'started_at': self.started_at.isoformat(),
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            'duration_seconds': round(self.duration, 3),
+            'stages': self.stage_summary(),
+            'counters': counters,
+            'posts': posts
+        }
+
+    def write_report(self, folder=None):
+        """Write the report as JSON; returns its path, or None when it could not be written"""
+        folder = folder or METRICS_CONFIG['report_dir']
+        path = os.path.join(folder, f"{self.started_at:%Y%m%d_%H%M%S}_{self.name}.json")
+        try:
+            os.makedirs(folder, exist_ok=True)
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(self.report(), f, ensure_ascii=False, indent=2)
+        except OSError as e:
+            print(f"⚠️ Could not write metrics report: {e}")
+            return None
+        return path
+
+    def print_summary(self):
+        stages = self.stage_summary()
+        print(f"\n⏱️  STAGE TIMINGS for {self.name} ({self.duration:.1f}s)")
+        print("=" * 50)
+        print(f"{'stage':<18}{'count':>6}{'p50':>9}{'p95':>9}{'total':>10}")
+        for stage, summary in sorted(stages.items(), key=lambda item: -item[1]['total']):
+            print(f"{stage:<18}{summary['count']:>6}{summary['p50']:>8.2f}s{summary['p95']:>8.2f}s{summary['total']:>9.1f}s")
+        with self._lock:
+            counters = dict(self.counters)
+        for counter, value in sorted(counters.items()):
+            if counter.startswith('bytes_'):
+                print(f"📦 {counter}: {value / (1024 * 1024):.1f} MB")
+            else:
+                print(f"🔢 {counter}: {value:,}")
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _label_text(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape_label(value)}"' for name, value in labels) + "}"
+
+class MetricsRegistry:
+    """Process-wide counters and stage histograms for the /metrics endpoint.
+
+    Unlike RunMetrics it is cumulative over every profile of a long-running
+    process. Gauges such as queue depths are read on each scrape from
+    collector callbacks registered by the running pipelines.
+    """
+
+    BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+    def __init__(self):
+        self._lock = Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._collectors = {}
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {'buckets': [0] * len(self.BUCKETS), 'sum': 0.0, 'count': 0}
+            for index, bound in enumerate(self.BUCKETS):
+                if value <= bound:
+                    histogram['buckets'][index] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def add_collector(self, key, collect):
+        """collect() returns (name, labels dict, value) gauge samples, read on every scrape"""
+        with self._lock:
+            self._collectors[key] = collect
+
+    def remove_collector(self, key):
+        with self._lock:
+            self._collectors.pop(key, None)
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: {**value, 'buckets': list(value['buckets'])} for key, value in self._histograms.items()}
+            collectors = list(self._collectors.values())
+
+        gauges = {}
+        for collect in collectors:
+            try:
+                for name, labels, value in collect():
+                    gauges[(name, tuple(sorted(labels.items())))] = value
+            except Exception as e:
+                print(f"⚠️ Metrics collector failed: {e}")
+
+        lines = []
+        for kind, samples in (('counter', counters), ('gauge', gauges)):
+            for name in sorted({name for name, _ in samples}):
+                lines.append(f"# TYPE {name} {kind}")
+                for (sample_name, labels), value in sorted(samples.items()):
+                    if sample_name == name:
+                        lines.append(f"{name}{_label_text(labels)} {value}")
+
+        for name in sorted({name for name, _ in histograms}):
+            lines.append(f"# TYPE {name} histogram")
+            for (sample_name, labels), histogram in sorted(histograms.items()):
+                if sample_name != name:
+                    continue
+                for bound, count in zip(self.BUCKETS, histogram['buckets']):
+                    lines.append(f"{name}_bucket{_label_text(labels + (('le', bound),))} {count}")
+                lines.append(f"{name}_bucket{_label_text(labels + (('le', '+Inf'),))} {histogram['count']}")
+                lines.append(f"{name}_sum{_label_text(labels)} {histogram['sum']:.6f}")
+                lines.append(f"{name}_count{_label_text(labels)} {histogram['count']}")
+
+        return "\n".join(lines) + "\n"
+
+registry = MetricsRegistry()
+
+def start_metrics_server(port=None, host=None):
+    """Serve the registry at http://host:port/metrics from a daemon thread; returns the server or None"""
+    port = port or METRICS_CONFIG['port']
+    host = host or METRICS_CONFIG['host']
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # Scrapes every few seconds would drown the scraper's own output
+
+    try:
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+    except OSError as e:
+        print(f"❌ Could not start metrics exporter on {host}:{port}: {e}")
+        return None
+
+    server.daemon_threads = True
+    Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    print(f"📈 Metrics exporter: http://{host}:{server.server_address[1]}/metrics")
+    return server
+
+# Module-level helpers record into the current run (when there is one) and into
+# the process-wide registry, so shared code (gateways, downloads, the cache)
+# can call them unconditionally.
+
+@contextlib.contextmanager
+def timed(stage, shortcode=None):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - started, shortcode)
+
+def observe(stage, seconds, shortcode=None, runs=None):
+    """Record a stage duration; runs names the RunMetrics to charge instead of the current run"""
+    if not METRICS_CONFIG['enabled']:
+        return
+    registry.observe('scraper_stage_seconds', seconds, stage=stage)
+    for run in (runs if runs is not None else (current_run.get(),)):
+        if run is not None:
+            run.observe(stage, seconds, shortcode)
+
+def add_counter(counter, amount=1, **labels):
+    if not METRICS_CONFIG['enabled'] or not amount:
+        return
+    registry.inc(f"scraper_{counter}_total", amount, **labels)
+    run = current_run.get()
+    if run is not None:
+        run.add(counter, amount, **labels)
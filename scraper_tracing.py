@@ -0,0 +1,242 @@
+import atexit
+import contextlib
+import contextvars
+import json
+import os
+import secrets
+import sys
+import time
+import traceback
+from threading import Lock
+
+# Tracing writes spans to a local JSONL file in the OTLP/JSON layout of the
+# OpenTelemetry Collector's file exporter, so the traces can be replayed into
+# any OTLP backend. An empty path turns exporting off.
+TRACING_CONFIG = {
+    'path': os.getenv('SCRAPER_TRACE_FILE', ''),
+    'service_name': os.getenv('SCRAPER_SERVICE_NAME', 'instagram-scraper'),
+    'batch_size': int(os.getenv('SCRAPER_TRACE_BATCH_SIZE', '64'))
+}
+
+# OTLP status codes
+STATUS_UNSET = 0
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+# Active span of this thread or task. Like scraper_metrics.current_run it
+# follows work into pipeline worker threads and enrichment coroutines.
+current_span = contextvars.ContextVar('current_span', default=None)
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+def _otlp_attributes(attributes):
+    return [{'key': key, 'value': _otlp_value(value)} for key, value in attributes.items() if value is not None]
+
+class Span:
+    """One timed operation with W3C trace context ids.
+
+    A span without a parent starts a new trace. Spans may be ended on another
+    thread than the one that started them (a post's span is ended by whichever
+    stage finishes it).
+    """
+
+    def __init__(self, name, parent=None, attributes=None):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.parent_span_id = parent.span_id if parent else None
+        self.attributes = dict(attributes or {})
+        self.events = []
+        self.status_code = STATUS_UNSET
+        self.status_message = ""
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+
+    @property
+    def traceparent(self):
+        """W3C traceparent header value of this span"""
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def set_error(self, message):
+        self.status_code = STATUS_ERROR
+        self.status_message = message
+
+    def record_exception(self, error):
+        """Add an exception event (type, message, stack trace) and mark the span failed"""
+        self.events.append({
+            'timeUnixNano': str(time.time_ns()),
+            'name': 'exception',
+            'attributes': _otlp_attributes({
+                'exception.type': type(error).__name__,
+                'exception.message': str(error),
+                'exception.stacktrace': "".join(traceback.format_exception(error))
+            })
+        })
+        self.set_error(f"{type(error).__name__}: {error}")
+
+    def end(self):
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        exporter = get_exporter()
+        if exporter:
+            exporter.export(self)
+
+    def to_otlp(self):
+        span = {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': 1,  # SPAN_KIND_INTERNAL
+            'startTimeUnixNano': str(self.start_ns),
+            'endTimeUnixNano': str(self.end_ns),
+            'attributes': _otlp_attributes(self.attributes),
+            'events': self.events,
+            'status': {'code': self.status_code, 'message': self.status_message}
+        }
+        if self.parent_span_id:
+            span['parentSpanId'] = self.parent_span_id
+        return span
+
+class FileSpanExporter:
+    """Appends finished spans to a JSONL file, one resourceSpans batch per line"""
+
+    def __init__(self, path, service_name=None, batch_size=None):
+        self.path = path
+        self.service_name = service_name or TRACING_CONFIG['service_name']
+        self.batch_size = batch_size or TRACING_CONFIG['batch_size']
+        self._spans = []
+        self._lock = Lock()
+
+        folder = os.path.dirname(self.path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+    def export(self, span):
+        with self._lock:
+            self._spans.append(span.to_otlp())
+            if len(self._spans) >= self.batch_size:
+                self._write()
+
+    def flush(self):
+        with self._lock:
+            self._write()
+
+    def _write(self):
+        if not self._spans:
+            return
+        batch = {'resourceSpans': [{
+            'resource': {'attributes': _otlp_attributes({'service.name': self.service_name})},
+            'scopeSpans': [{'scope': {'name': 'scraper_tracing'}, 'spans': self._spans}]
+        }]}
+        try:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(batch, ensure_ascii=False) + "\n")
+        except OSError as e:
+            print(f"⚠️ Could not write {len(self._spans)} trace spans: {e}")
+        self._spans = []
+
+_exporter = None
+_exporter_lock = Lock()
+
+def get_exporter():
+    """Process-wide exporter for TRACING_CONFIG['path'], or None when tracing is off"""
+    global _exporter
+    if not TRACING_CONFIG['path']:
+        return None
+    with _exporter_lock:
+        if _exporter is None or _exporter.path != TRACING_CONFIG['path']:
+            if _exporter:
+                _exporter.flush()
+            _exporter = FileSpanExporter(TRACING_CONFIG['path'])
+            atexit.register(_exporter.flush)
+        return _exporter
+
+def flush_spans():
+    exporter = get_exporter()
+    if exporter:
+        exporter.flush()
+
+@contextlib.contextmanager
+def span(name, parent=None, **attributes):
+    """Run the block in a new span, a child of parent or of the current span
+
+    Exceptions leaving the block are recorded on the span and re-raised.
+    """
+    current = Span(name, parent or current_span.get(), attributes)
+    token = current_span.set(current)
+    try:
+        yield current
+    except Exception as e:
+        current.record_exception(e)
+        raise
+    finally:
+        current_span.reset(token)
+        current.end()
+
+def load_spans(path):
+    """All spans of an exported trace file, flattened"""
+    spans = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            for resource_spans in json.loads(line)['resourceSpans']:
+                for scope_spans in resource_spans['scopeSpans']:
+                    spans.extend(scope_spans['spans'])
+    return spans
+
+def _attribute(span, key):
+    for attribute in span['attributes']:
+        if attribute['key'] == key:
+            return next(iter(attribute['value'].values()))
+    return None
+
+def print_post_trace(path, shortcode):
+    """Print the span tree of one post: offset from the post's start, duration and status"""
+    spans = load_spans(path)
+    roots = [span for span in spans if span['name'] == 'post' and _attribute(span, 'post.shortcode') == shortcode]
+    if not roots:
+        print(f"❌ No post span for {shortcode} in {path}")
+        return
+
+    children = {}
+    for span in spans:
+        children.setdefault(span.get('parentSpanId'), []).append(span)
+
+    def show(span, start, depth):
+        offset = (int(span['startTimeUnixNano']) - start) / 1e9
+        duration = (int(span['endTimeUnixNano']) - int(span['startTimeUnixNano'])) / 1e9
+        status = "❌ " + span['status']['message'] if span['status']['code'] == STATUS_ERROR else ""
+        print(f"{'  ' * depth}{span['name']:<{40 - 2 * depth}} +{offset:7.2f}s {duration:8.3f}s {status}")
+        for child in sorted(children.get(span['spanId'], []), key=lambda child: int(child['startTimeUnixNano'])):
+            show(child, start, depth + 1)
+
+    for root in roots:
+        print(f"🔎 trace {root['traceId']} (agent {_attribute(root, 'agent.id')}, {_attribute(root, 'post.status')})")
+        show(root, int(root['startTimeUnixNano']), 0)
+
+def print_slowest_posts(path, limit=10):
+    spans = [span for span in load_spans(path) if span['name'] == 'post']
+    spans.sort(key=lambda span: int(span['startTimeUnixNano']) - int(span['endTimeUnixNano']))
+    print(f"🐢 Slowest posts in {path}")
+    for span in spans[:limit]:
+        duration = (int(span['endTimeUnixNano']) - int(span['startTimeUnixNano'])) / 1e9
+        print(f"{_attribute(span, 'post.shortcode'):<16}{duration:8.2f}s  {_attribute(span, 'post.status')}")
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python scraper_tracing.py TRACE_FILE [SHORTCODE]")
+        sys.exit(1)
+    if len(sys.argv) > 2:
+        print_post_trace(sys.argv[1], sys.argv[2])
+    else:
+        print_slowest_posts(sys.argv[1])
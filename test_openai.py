@@ -15,6 +15,9 @@ import uuid
 from datetime import datetime
 import json
 from openai import OpenAI  # Updated import to match test_openai.py
+from content_cache import cached_chat_completion
+from rate_limits import get_gateway
+from text_analysis import detect_language
 
 load_dotenv()
 
@@ -25,7 +28,8 @@ api_key = "sk_b03b8f47d46f87bcf7650605247cf32635f4bb224f6043b0"
 client = OpenAI(
     api_key=os.getenv("OPENROUTER_API_KEY", "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"),
     base_url="https://openrouter.ai/api/v1",
-    default_headers={"HTTP-Referer": "https://localhost"}  # Required for OpenRouter
+    default_headers={"HTTP-Referer": "https://localhost"},  # Required for OpenRouter
+    max_retries=0  # Retries and backoff are handled by the provider gateway (rate_limits.py)
 )
 
 # Database configuration
@@ -83,13 +87,6 @@ def ensure_database_structure(connection):
         if cursor:
             cursor.close()
 
-def detect_language(text):
-    """Detect if text is Persian/Farsi or English"""
-    persian_chars = set('آابپتثجچحخدذرزژسشصضطظعغفقکگلمنوهی')
-    text_chars = set(text.replace(' ', '').replace('\n', ''))
-    persian_ratio = len(text_chars.intersection(persian_chars)) / max(len(text_chars), 1)
-    return 'persian' if persian_ratio > 0.3 else 'english'
-
 def enhance_transcription_with_openai(transcription, caption="", agent_name="", min_words=500):
     """
     Use OpenAI to enhance and expand a transcription to meet minimum word requirements.
@@ -196,7 +193,9 @@ Maintain the original meaning and tone while making the content natural and valu
         print(f"📝 System prompt length: {len(system_prompt)} chars")
         print(f"📝 User prompt length: {len(user_prompt)} chars")
 
-        response = client.chat.completions.create(
+        enhanced_content = cached_chat_completion(
+            client,
+            gateway=get_gateway('openrouter'),
             model="meta-llama/llama-3.1-8b-instruct",
             messages=[
                 {"role": "system", "content": system_prompt},
@@ -204,9 +203,7 @@ Maintain the original meaning and tone while making the content natural and valu
             ],
             max_tokens=4000,
             temperature=0.8
-        )
-
-        enhanced_content = response.choices[0].message.content.strip()
+        ).strip()
         enhanced_word_count = len(enhanced_content.split())
         
         print("✅ OpenAI transcription enhancement completed")
@@ -245,7 +242,9 @@ Paragraph 5 (minimum 120 words): Professional recommendations and important buyi
 
 Total must be at least {min_words} words. Write each paragraph completely and in detail."""
             
-            retry_response = client.chat.completions.create(
+            retry_content = cached_chat_completion(
+                client,
+                gateway=get_gateway('openrouter'),
                 model="meta-llama/llama-3.1-8b-instruct",
                 messages=[
                     {"role": "system", "content": system_prompt},
@@ -253,9 +252,7 @@ Total must be at least {min_words} words. Write each paragraph completely and in
                 ],
                 max_tokens=4000,
                 temperature=0.9
-            )
-            
-            retry_content = retry_response.choices[0].message.content.strip()
+            ).strip()
             retry_word_count = len(retry_content.split())
             
             print(f"🔄 Retry completed: {retry_word_count} words")
@@ -334,7 +331,9 @@ Original Caption ({current_word_count} words):
 Please expand this caption into a comprehensive property description of at least {target_words} words while maintaining the original tone and style.
 """
 
-        response = client.chat.completions.create(
+        enhanced_content = cached_chat_completion(
+            client,
+            gateway=get_gateway('openrouter'),
             model="meta-llama/llama-3.1-8b-instruct",
             messages=[
                 {"role": "system", "content": system_prompt},
@@ -342,9 +341,7 @@ Please expand this caption into a comprehensive property description of at least
             ],
             max_tokens=2000,
             temperature=0.7
-        )
-
-        enhanced_content = response.choices[0].message.content.strip()
+        ).strip()
         enhanced_word_count = len(enhanced_content.split())
         
         print("✅ OpenAI caption enhancement completed")
@@ -638,13 +635,17 @@ def download_instagram_profile(username, browser="firefox", max_posts=5):
                         with open(new_video_path, 'rb') as f:
                             audio_data = BytesIO(f.read())
                         
-                        transcription = elevenlabs.speech_to_text.convert(
-                            file=audio_data,
-                            model_id="scribe_v1",
-                            tag_audio_events=True,
-                            language_code="fas",
-                            diarize=True,
-                        )
+                        def convert():
+                            audio_data.seek(0)  # Retries resend the whole file
+                            return elevenlabs.speech_to_text.convert(
+                                file=audio_data,
+                                model_id="scribe_v1",
+                                tag_audio_events=True,
+                                language_code="fas",
+                                diarize=True,
+                            )
+
+                        transcription = get_gateway('elevenlabs').call(convert)
                         
                         original_transcription = transcription.text
                         
@@ -0,0 +1,213 @@
+import argparse
+import codecs
+import os
+import re
+import string
+import time
+import unicodedata
+
+# NumPy is optional: with it every script is counted in one vectorized pass
+# over the text's code points. Without it the text is classified in one pass
+# by a C charmap encoder (see _script_counts_python).
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+TEXT_ANALYSIS_CONFIG = {
+    # Share of non-whitespace characters that are Persian letters for a text to count as Persian
+    'persian_threshold': float(os.getenv('PERSIAN_LANGUAGE_THRESHOLD', '0.3'))
+}
+
+PERSIAN_LETTERS = 'آابپتثجچحخدذرزژسشصضطظعغفقکگلمنوهی'
+
+ARABIC_SCRIPT_RANGES = ((0x0600, 0x06FF), (0x0750, 0x077F), (0x08A0, 0x08FF), (0xFB50, 0xFDFF), (0xFE70, 0xFEFF))
+
+# Character classes, built once at import
+WHITESPACE, PERSIAN, ARABIC, LATIN, OTHER = range(5)
+
+# Arabic-script letters and marks outside the Persian alphabet (ي ك ة, harakat, presentation forms)
+_ARABIC_LETTERS = ''.join(
+    chr(code) for start, end in ARABIC_SCRIPT_RANGES for code in range(start, end + 1)
+    if chr(code) not in PERSIAN_LETTERS and unicodedata.category(chr(code))[0] in 'LM'
+)
+# Latin letters beyond ASCII (é, ß, ğ, ...)
+_LATIN_EXTENDED = ''.join(chr(code) for code in range(0x80, 0x250) if unicodedata.category(chr(code)).startswith('L'))
+_WHITESPACE = ''.join(chr(code) for code in range(0x10000) if chr(code).isspace())
+
+_CHARACTER_CLASSES = {}
+for characters, class_of_characters in ((PERSIAN_LETTERS, PERSIAN), (_ARABIC_LETTERS, ARABIC),
+                                        (string.ascii_letters + _LATIN_EXTENDED, LATIN), (_WHITESPACE, WHITESPACE)):
+    _CHARACTER_CLASSES.update(dict.fromkeys(characters, class_of_characters))
+
+# Pure-Python path: a one-byte charmap codec. ASCII keeps its bytes, the other
+# 128 bytes stand for the Persian letters, the non-ASCII whitespace and the
+# most frequent characters of Persian/Arabic text (ي ك ة, harakat, ZWNJ,
+# Persian digits and punctuation, Latin-1 letters). codecs.charmap_encode runs
+# the whole text through it in C, every other character becomes '?', and one
+# bytes.translate turns the bytes into their classes.
+_COMMON_CHARACTERS = (
+    PERSIAN_LETTERS
+    + ''.join(character for character in _WHITESPACE if ord(character) > 0x7F)
+    + 'يكةءأإؤئىـ' + ''.join(map(chr, range(0x064B, 0x0653))) + '\u0670'
+    + '\u200c\u200d،؛؟«»٪٫٬…–—‘’“”•' + ''.join(map(chr, range(0x06F0, 0x06FA))) + ''.join(map(chr, range(0x0660, 0x066A)))
+)
+_DECODING_TABLE = ''.join(map(chr, range(0x80))) + _COMMON_CHARACTERS
+_DECODING_TABLE += ''.join(character for character in _LATIN_EXTENDED if character not in _DECODING_TABLE)[:256 - len(_DECODING_TABLE)]
+_ENCODING_MAP = codecs.charmap_build(_DECODING_TABLE)
+_BYTE_CLASSES = bytes(_CHARACTER_CLASSES.get(character, OTHER) for character in _DECODING_TABLE)
+# Letters and whitespace without a byte of their own; only looked for when the encoder replaced some BMP character
+_UNMAPPED_CLASSES = re.compile(f"[{re.escape(''.join(character for character in _CHARACTER_CLASSES if character not in _DECODING_TABLE))}]")
+
+if np is not None:
+    # Class of every BMP code point; everything above U+FFFF (emoji) maps to the last entry
+    _CLASS_TABLE = np.full(0x10001, OTHER, dtype=np.uint8)
+    for character, class_of_character in _CHARACTER_CLASSES.items():
+        _CLASS_TABLE[ord(character)] = class_of_character
+
+def _counts_from_classes(counts, length):
+    return {
+        'persian': int(counts[PERSIAN]),
+        'arabic': int(counts[ARABIC]),
+        'latin': int(counts[LATIN]),
+        'total': int(length - counts[WHITESPACE])
+    }
+
+def _script_counts_numpy(text):
+    code_points = np.frombuffer(text.encode('utf-32-le', 'surrogatepass'), dtype=np.uint32)
+    return _counts_from_classes(np.bincount(_CLASS_TABLE[np.minimum(code_points, 0x10000)], minlength=5), len(code_points))
+
+def _script_counts_python(text):
+    encoded = codecs.charmap_encode(text, 'replace', _ENCODING_MAP)[0]
+    classes = encoded.translate(_BYTE_CLASSES)
+    counts = [classes.count(class_of_bytes) for class_of_bytes in range(5)]
+
+    # Characters outside the codec came out as '?'. Emoji (above U+FFFF) are
+    # OTHER anyway; anything else may be a rarer letter or whitespace.
+    replaced = encoded.count(b'?') - text.count('?')
+    if replaced and replaced > len(text.encode('utf-16-le', 'surrogatepass')) // 2 - len(text):
+        for character in _UNMAPPED_CLASSES.findall(text):
+            counts[OTHER] -= 1
+            counts[_CHARACTER_CLASSES[character]] += 1
+    return _counts_from_classes(counts, len(text))
+
+_script_counts = _script_counts_numpy if np is not None else _script_counts_python
+
+def _ratios(counts):
+    total = max(counts['total'], 1)
+    return {script: counts[script] / total for script in ('persian', 'arabic', 'latin')}
+
+def _language(counts):
+    persian_ratio = counts['persian'] / max(counts['total'], 1)
+    return 'persian' if persian_ratio > TEXT_ANALYSIS_CONFIG['persian_threshold'] else 'english'
+
+def script_counts(text):
+    """Persian, other Arabic-script and Latin letters in text, plus its non-whitespace length
+
+    Persian counts the 33 letters of the Persian alphabet; arabic counts the
+    remaining Arabic-script letters and marks; everything else that is not
+    whitespace (digits, punctuation, emoji, ZWNJ) only adds to total.
+    """
+    if not text:
+        return {'persian': 0, 'arabic': 0, 'latin': 0, 'total': 0}
+    return _script_counts(text)
+
+def script_ratios(text):
+    """Persian, Arabic and Latin shares of the text's non-whitespace characters"""
+    return _ratios(script_counts(text))
+
+def count_persian_characters(text):
+    """Count Persian/Farsi letters in text"""
+    return script_counts(text)['persian']
+
+def detect_language(text):
+    """Detect if text is Persian/Farsi or English from the share of Persian letters
+
+    The share is taken over all non-whitespace characters, counting every
+    occurrence. The legacy check compared sets of distinct characters, so a
+    short English caption with a few Persian hashtags used to come out
+    'persian' and now comes out 'english'.
+    """
+    return _language(script_counts(text))
+
+# Implementations replaced by this module, kept for the benchmark below
+
+def legacy_count_persian_characters(text):
+    if not text:
+        return 0
+
+    persian_chars = set('آابپتثجچحخدذرزژسشصضطظعغفقکگلمنوهی')
+    return sum(1 for char in text if char in persian_chars)
+
+def legacy_detect_language(text):
+    persian_chars = set('آابپتثجچحخدذرزژسشصضطظعغفقکگلمنوهی')
+    text_chars = set(text.replace(' ', '').replace('\n', ''))
+    persian_ratio = len(text_chars.intersection(persian_chars)) / max(len(text_chars), 1)
+    return 'persian' if persian_ratio > 0.3 else 'english'
+
+BENCHMARK_SAMPLES = (
+    "سلام دوستان امروز میخوایم یه آپارتمان دو خوابه در دبی مارینا رو ببینیم که ویو کامل دریا داره. ",
+    "قیمت این ویلا حدود ۵ میلیون درهمه و اقساط پنج ساله داره 🏠 #دبی #ملک ",
+    "Luxury 2BR apartment in Dubai Marina with full sea view, 2M AED, 5-year payment plan. ",
+    "شقة فاخرة في دبي مارينا مع إطلالة كاملة على البحر، السعر مليونا درهم. ",
+)
+
+def _benchmark_texts(megabytes, text_chars):
+    """About megabytes of mixed Persian/English/Arabic text, in texts of about text_chars characters"""
+    texts = []
+    size = 0
+    index = 0
+    while size < megabytes * 1024 * 1024:
+        text = []
+        while sum(map(len, text)) < text_chars:
+            text.append(BENCHMARK_SAMPLES[index % len(BENCHMARK_SAMPLES)])
+            index += 1
+        texts.append("".join(text))
+        size += len(texts[-1].encode('utf-8'))
+    return texts
+
+def _time(function, texts):
+    started = time.perf_counter()
+    results = [function(text) for text in texts]
+    return time.perf_counter() - started, results
+
+def run_benchmark(megabytes=4, text_chars=2000):
+    """Time the legacy functions against this module on one large text and on a batch of transcript-sized texts
+
+    Each implementation is passed in explicitly, so the benchmark never
+    changes which one the module's functions use.
+    """
+    batches = {
+        f"1 x {megabytes} MB text": ["".join(_benchmark_texts(megabytes, 64 * 1024))],
+        f"{megabytes} MB of ~{text_chars}-char texts": _benchmark_texts(megabytes, text_chars)
+    }
+    implementations = [('python', _script_counts_python)] + ([('numpy', _script_counts_numpy)] if np is not None else [])
+
+    print(f"🧪 Text analysis benchmark ({'NumPy available' if np is not None else 'NumPy not installed'})")
+    for batch_name, texts in batches.items():
+        megabytes_total = sum(len(text.encode('utf-8')) for text in texts) / (1024 * 1024)
+        print(f"\n📦 {batch_name} ({len(texts)} texts, {megabytes_total:.1f} MB)")
+
+        legacy_seconds, legacy_counts = _time(legacy_count_persian_characters, texts)
+        legacy_detect_seconds, _ = _time(legacy_detect_language, texts)
+        print(f"{'legacy count_persian_characters':<40}{legacy_seconds:>8.3f}s {megabytes_total / legacy_seconds:>8.1f} MB/s")
+        print(f"{'legacy detect_language':<40}{legacy_detect_seconds:>8.3f}s {megabytes_total / legacy_detect_seconds:>8.1f} MB/s")
+
+        for implementation, counts_of in implementations:
+            seconds, counts = _time(lambda text: counts_of(text)['persian'], texts)
+            assert counts == legacy_counts, "count_persian_characters differs from the legacy count"
+            ratio_seconds, _ = _time(lambda text: _ratios(counts_of(text)), texts)
+            detect_seconds, _ = _time(lambda text: _language(counts_of(text)), texts)
+            print(f"{f'count_persian_characters ({implementation})':<40}{seconds:>8.3f}s "
+                  f"{megabytes_total / seconds:>8.1f} MB/s  {legacy_seconds / seconds:>5.1f}x")
+            print(f"{f'script_ratios ({implementation})':<40}{ratio_seconds:>8.3f}s "
+                  f"{megabytes_total / ratio_seconds:>8.1f} MB/s  {legacy_detect_seconds / ratio_seconds:>5.1f}x vs detect_language")
+            print(f"{f'detect_language ({implementation})':<40}{detect_seconds:>8.3f}s "
+                  f"{megabytes_total / detect_seconds:>8.1f} MB/s  {legacy_detect_seconds / detect_seconds:>5.1f}x")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark Persian script detection against the legacy implementations")
+    parser.add_argument('--mb', type=float, default=4, help="Megabytes of text per batch (default: 4)")
+    parser.add_argument('--text-chars', type=int, default=2000, help="Characters per text in the batch of small texts")
+    args = parser.parse_args()
+    run_benchmark(args.mb, args.text_chars)